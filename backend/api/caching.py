@@ -0,0 +1,73 @@
+from gzip import compress
+from threading import Lock
+
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+RECIPE_RESPONSES = 'recipes:responses'
+
+
+def generation_key(name):
+    return f'generation:{name}'
+
+
+def get_generation(name):
+    """Текущее поколение данных `name` для ключей кэша."""
+    key = generation_key(name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, 1, timeout=None)
+        generation = cache.get(key, 1)
+    return generation
+
+
+def bump_generation(name):
+    """Сдвигает поколение: все ключи со старым поколением устаревают.
+
+    Возвращает новое поколение.
+    """
+    key = generation_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+        return 1
+
+
+def relations_generation(user):
+    """Версия подписок, избранного и списка покупок пользователя."""
+    if user.is_anonymous:
+        return 0
+    return get_generation(f'relations:{user.id}')
+
+
+def bump_relations_generation(user):
+    bump_generation(f'relations:{user.id}')
+
+
+class PayloadCache:
+    """Готовые JSON-ответы в памяти процесса.
+
+    Хранит тело ответа и его gzip-версию вместе с поколением данных.
+    Когда поколение в общем кэше меняется, каждый процесс пересобирает
+    ответ при следующем запросе.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.payloads = {}
+
+    def get(self, name, build):
+        """Возвращает `(json, gzip)` для данных `name`."""
+        generation = get_generation(name)
+        payload = self.payloads.get(name)
+        if payload is None or payload[0] != generation:
+            with self.lock:
+                payload = self.payloads.get(name)
+                if payload is None or payload[0] != generation:
+                    content = JSONRenderer().render(build())
+                    payload = (generation, content, compress(content))
+                    self.payloads[name] = payload
+        return payload[1], payload[2]
+
+
+payload_cache = PayloadCache()
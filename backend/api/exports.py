@@ -0,0 +1,97 @@
+import csv
+import json
+
+from django.db.models import F
+from django.utils import timezone
+
+from recipes.models import CartIngredient
+
+DATE_FORMAT = '%d-%m-%Y %H:%M'
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+
+class Echo:
+    """Буфер для `csv.writer`, который сразу возвращает строку."""
+    def write(self, value):
+        return value
+
+
+def shopping_list_rows(user):
+    """Ингредиенты из списка покупок пользователя.
+
+    Читаются из готовой таблицы сумм курсором на стороне сервера
+    порциями по `CHUNK_SIZE`.
+    """
+    return CartIngredient.objects.filter(user=user).values(
+        name=F('ingredient__name'),
+        measure=F('ingredient__measurement_unit'),
+        quantity=F('total_amount'),
+    ).order_by('ingredient__name').iterator(chunk_size=CHUNK_SIZE)
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    """Склеивает мелкие строки в блоки примерно по `size` байт."""
+    buffer = []
+    length = 0
+    for line in lines:
+        line = line.encode()
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def shopping_list_txt(user, rows):
+    yield (
+        f'Список покупок для:\n\n{user.first_name}\n'
+        f'{timezone.now().strftime(DATE_FORMAT)}\n'
+    )
+    for row in rows:
+        yield f'{row["name"]}: {row["quantity"]} {row["measure"]}\n'
+    yield '\n\nПосчитано в Foodgram'
+
+
+def shopping_list_csv(user, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('ingredient', 'quantity', 'measurement_unit'))
+    for row in rows:
+        yield writer.writerow(
+            (row['name'], row['quantity'], row['measure'])
+        )
+
+
+def shopping_list_json(user, rows):
+    yield (
+        f'{{"user": {json.dumps(user.username, ensure_ascii=False)}, '
+        f'"created": "{timezone.now().isoformat()}", "ingredients": ['
+    )
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(
+            {
+                'name': row['name'],
+                'amount': row['quantity'],
+                'measurement_unit': row['measure'],
+            },
+            ensure_ascii=False,
+        )
+        separator = ', '
+    yield ']}'
+
+
+SHOPPING_LIST_EXPORTS = {
+    'txt': (shopping_list_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list_csv, 'text/csv; charset=utf-8'),
+    'json': (shopping_list_json, 'application/json; charset=utf-8'),
+}
+
+
+def export_shopping_list(user, file_format):
+    """Возвращает генератор файла и его content type."""
+    export, content_type = SHOPPING_LIST_EXPORTS[file_format]
+    return buffered(export(user, shopping_list_rows(user))), content_type
@@ -0,0 +1,113 @@
+import binascii
+from base64 import b64decode
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers
+
+# Длина куска base64, кратна 4: куски декодируются независимо.
+CHUNK_SIZE = 64 * 1024
+# Форматы Pillow и расширения сохраняемых файлов.
+IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+
+class StreamingImageField(serializers.ImageField):
+    """Картинка в base64 с ограничениями по размеру.
+
+    Строка декодируется кусками во временный файл, который переходит
+    на диск после `IMAGE_UPLOAD_SPOOL_SIZE` байт. Слишком большая строка
+    отклоняется до декодирования, а размеры картинки проверяются по
+    заголовку, без распаковки пикселей.
+    """
+    default_error_messages = {
+        'invalid': 'Картинка должна быть строкой base64.',
+        'too_large': 'Картинка больше {max_size} МБ.',
+        'too_many_pixels': 'Картинка больше {max_pixels} мегапикселей.',
+        'invalid_image': 'Загрузите корректную картинку '
+                         '(JPEG, PNG, GIF или WebP).',
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        header = data.find(';base64,', 0, 100)
+        start = header + len(';base64,') if header != -1 else 0
+        if (len(data) - start) // 4 * 3 > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.fail(
+                'too_large',
+                max_size=settings.IMAGE_UPLOAD_MAX_BYTES // 2 ** 20,
+            )
+        file = self.decode(data, start)
+        size = file.tell()
+        image_format = self.check_image(file)
+        return UploadedFile(
+            file=file,
+            name=f'{uuid4()}.{IMAGE_FORMATS[image_format]}',
+            content_type=Image.MIME[image_format],
+            size=size,
+        )
+
+    def decode(self, data, start):
+        """Декодирует base64 с позиции `start` кусками во временный файл.
+
+        Строка не копируется целиком: в памяти только текущий кусок.
+        """
+        file = SpooledTemporaryFile(max_size=settings.IMAGE_UPLOAD_SPOOL_SIZE)
+        try:
+            for offset in range(start, len(data), CHUNK_SIZE):
+                file.write(
+                    b64decode(data[offset:offset + CHUNK_SIZE], validate=True)
+                )
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_image')
+        return file
+
+    def check_image(self, file):
+        """Проверяет формат и размеры по заголовку, затем структуру файла.
+
+        Возвращает формат картинки. Если картинка не подошла, временный
+        файл закрывается.
+        """
+        try:
+            image_format = self.read_image(file)
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return image_format
+
+    def read_image(self, file):
+        """Формат картинки после проверок.
+
+        Картинка больше предела Pillow `Image.MAX_IMAGE_PIXELS` тоже
+        отклоняется: размеры сравниваются с ним напрямую, без глобального
+        фильтра предупреждений, который не работает в потоках.
+        """
+        max_pixels = settings.IMAGE_UPLOAD_MAX_PIXELS
+        if Image.MAX_IMAGE_PIXELS:
+            max_pixels = min(max_pixels, Image.MAX_IMAGE_PIXELS)
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                if image.format not in IMAGE_FORMATS:
+                    self.fail('invalid_image')
+                width, height = image.size
+                if width * height > max_pixels:
+                    self.fail(
+                        'too_many_pixels', max_pixels=max_pixels // 10 ** 6
+                    )
+                image.verify()
+                return image.format
+        except Image.DecompressionBombError:
+            self.fail('too_many_pixels', max_pixels=max_pixels // 10 ** 6)
+        except (UnidentifiedImageError, OSError, SyntaxError):
+            self.fail('invalid_image')
@@ -1,8 +1,27 @@
+from hashlib import md5
+from time import sleep
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED)
 
+from recipes.cart import (add_recipes_to_cart_totals, add_to_cart_totals,
+                          remove_from_cart_totals,
+                          remove_recipes_from_cart_totals)
+from recipes.counters import change_counter
+from recipes.feed import follow_authors, unfollow_authors
+from .caching import bump_relations_generation, get_generation, payload_cache
+from .relations import (add_relation, add_relations, get_viewer_relations,
+                        remove_relation, remove_relations)
+
 ADD_MET = ('GET', 'POST',)
 DEL_MET = ('DELETE',)
 
@@ -13,15 +32,49 @@ class GetIsSubscribedMixin:
         user = self.context.get('request').user
         if user.is_anonymous or (user == obj):
             return False
-        return user.subscribe.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return get_viewer_relations(self.context.get('request')).has(
+            'is_subscribed', obj.id
+        )
+
+
+class ViewerRelationsMixin:
+    """Загружает связи пользователя со всеми объектами страницы."""
+    viewer_relations = ()
+
+    def get_serializer(self, *args, **kwargs):
+        if args and kwargs.get('many'):
+            relations = get_viewer_relations(self.request)
+            ids = [obj.id for obj in args[0]]
+            for name in self.viewer_relations:
+                relations.load(name, ids)
+        return super().get_serializer(*args, **kwargs)
 
 
 class AddDelViewMixin:
     """Добавляет добавляющий и удаляющий методы."""
     add_serializer = None
+    batch_serializer = None
+    relations = {
+        'subscribers': 'is_subscribed',
+        'favorite': 'is_favorited',
+        'shopping_cart': 'is_in_shopping_cart',
+    }
+    counters = {
+        'subscribers': 'subscribers_count',
+        'favorite': 'favorites_count',
+        'shopping_cart': 'in_carts_count',
+    }
 
     def add_del_method(self, object_id, manager):
-        """Добавляет и удаляет связь через менеджер."""
+        """Добавляет и удаляет связь.
+
+        Связь меняется одним запросом к промежуточной таблице, а ответ
+        определяется числом затронутых строк, поэтому параллельные
+        запросы не дают ни ошибок, ни двойного учёта в списке покупок
+        и счётчиках объекта.
+        """
         assert self.add_serializer is not None, (
             f'{self.__class__.__name__} should include '
             'an `add_serializer` attribute.'
@@ -30,22 +83,239 @@ class AddDelViewMixin:
         user = self.request.user
         if user.is_anonymous:
             return Response(status=HTTP_401_UNAUTHORIZED)
-        managers = {
-            'subscribers': user.subscribe,
-            'favorite': user.favorites,
-            'shopping_cart': user.carts,
-        }
-        manager = managers[manager]
-        object = get_object_or_404(self.queryset, id=object_id)
-        serializer = self.add_serializer(
-            object, context={'request': self.request}
-        )
-        object_exist = manager.filter(id=object_id).exists()
-        if (self.request.method in ADD_MET) and not object_exist:
-            manager.add(object)
+        in_cart = manager == 'shopping_cart'
+        following = manager == 'subscribers'
+        relation = self.relations[manager]
+        counter = self.counters[manager]
+        model = self.queryset.model
+        if self.request.method in ADD_MET:
+            object = get_object_or_404(self.queryset, id=object_id)
+            with transaction.atomic():
+                added = add_relation(user, relation, object.id)
+                if added:
+                    change_counter(model, counter, (object.id,), 1)
+                if added and in_cart:
+                    add_to_cart_totals(user, object)
+                if added and following:
+                    follow_authors(user, (object.id,))
+            if not added:
+                return Response(status=HTTP_400_BAD_REQUEST)
+            bump_relations_generation(user)
+            serializer = self.add_serializer(
+                object, context={'request': self.request}
+            )
             return Response(serializer.data, status=HTTP_201_CREATED)
 
-        if (self.request.method in DEL_MET) and object_exist:
-            manager.remove(object)
+        if self.request.method in DEL_MET:
+            with transaction.atomic():
+                removed = remove_relation(user, relation, object_id)
+                if removed:
+                    change_counter(model, counter, (object_id,), -1)
+                if removed and in_cart:
+                    remove_from_cart_totals(user, model(id=object_id))
+                if removed and following:
+                    unfollow_authors(user, (object_id,))
+            if not removed:
+                get_object_or_404(self.queryset, id=object_id)
+                return Response(status=HTTP_400_BAD_REQUEST)
+            bump_relations_generation(user)
             return Response(status=HTTP_204_NO_CONTENT)
         return Response(status=HTTP_400_BAD_REQUEST)
+
+    def add_del_batch(self, manager):
+        """Добавляет или удаляет связи с несколькими объектами сразу.
+
+        id проверяются одним запросом, связи меняются одной вставкой
+        или одним удалением. В ответе статус для каждого id: `added`,
+        `removed`, `unchanged` или `not_found`. Подписаться на себя
+        нельзя, для своего id возвращается `not_found`.
+        """
+        assert self.batch_serializer is not None, (
+            f'{self.__class__.__name__} should include '
+            'a `batch_serializer` attribute.'
+        )
+
+        user = self.request.user
+        if user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        serializer = self.batch_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(
+            self.queryset.filter(id__in=ids).values_list('id', flat=True)
+        )
+        in_cart = manager == 'shopping_cart'
+        following = manager == 'subscribers'
+        if following:
+            found.discard(user.id)
+        relation = self.relations[manager]
+        counter = self.counters[manager]
+        adding = self.request.method in ADD_MET
+        with transaction.atomic():
+            if adding:
+                changed = add_relations(user, relation, found)
+                if changed and in_cart:
+                    add_recipes_to_cart_totals(user, changed)
+                if changed and following:
+                    follow_authors(user, changed)
+            else:
+                changed = remove_relations(user, relation, found)
+                if changed and in_cart:
+                    remove_recipes_from_cart_totals(user, changed)
+                if changed and following:
+                    unfollow_authors(user, changed)
+            if changed:
+                change_counter(
+                    self.queryset.model, counter, changed, 1 if adding else -1
+                )
+        if changed:
+            bump_relations_generation(user)
+        done = 'added' if adding else 'removed'
+        return Response({'results': [
+            {
+                'id': object_id,
+                'status': (
+                    done if object_id in changed
+                    else 'unchanged' if object_id in found
+                    else 'not_found'
+                ),
+            }
+            for object_id in ids
+        ]})
+
+
+class ConditionalGetMixin:
+    """Отвечает `304 Not Modified`, если данные не изменились.
+
+    Валидаторы возвращает `get_validators`, они считаются до выборки
+    и сериализации данных. ETag запроса сохраняется в `response_etag`.
+    """
+    response_etag = None
+
+    def get_validators(self, request, *args, **kwargs):
+        """Возвращает ETag и время последнего изменения (timestamp)."""
+        return None, None
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, *args, **kwargs)
+        if etag is not None:
+            etag = quote_etag(etag)
+        self.response_etag = etag
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if etag is not None:
+                response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class CachedListMixin:
+    """Отдаёт полный список объектов из готового JSON в памяти процесса.
+
+    Используется для справочников: ответ без параметров запроса
+    собирается один раз на поколение данных модели.
+    """
+    def list(self, request, *args, **kwargs):
+        if (set(request.query_params) - {'format'}
+                or request.accepted_renderer.format != 'json'):
+            return super().list(request, *args, **kwargs)
+        content, compressed = payload_cache.get(
+            self.queryset.model._meta.label_lower,
+            lambda: self.get_serializer(self.get_queryset(), many=True).data,
+        )
+        response = HttpResponse(content_type='application/json')
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response.content = compressed
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response.content = content
+        response['Content-Length'] = len(response.content)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        patch_cache_control(
+            response, public=True, max_age=settings.CATALOG_MAX_AGE
+        )
+        return response
+
+
+class AnonymousCacheMixin:
+    """Кэширует ответы анонимным пользователям.
+
+    Ключ строится из нормализованных параметров `cache_params`,
+    поколения `cache_generation`, которое меняют сигналы моделей,
+    и ETag ответа, если его посчитал `ConditionalGetMixin`: данные,
+    которые меняются без сигналов, попадают в кэш под своим ETag.
+    Пока один процесс собирает ответ, остальные ждут его в кэше,
+    а не идут в базу.
+    """
+    cache_generation = None
+    cache_params = ()
+
+    def get_cache_key(self, request, **kwargs):
+        params = sorted(
+            (name, sorted(request.query_params.getlist(name)))
+            for name in self.cache_params
+            if name in request.query_params
+        )
+        etag = getattr(self, 'response_etag', None)
+        signature = md5(
+            f'{request.get_host()}:{self.action}:{kwargs}:{params}:{etag}'
+            .encode()
+        ).hexdigest()
+        generation = get_generation(self.cache_generation)
+        return f'response:{self.cache_generation}:{generation}:{signature}'
+
+    def wait_for(self, key):
+        """Ждёт, пока другой процесс положит ответ в кэш."""
+        for _ in range(settings.RESPONSE_CACHE_WAIT_STEPS):
+            sleep(settings.RESPONSE_CACHE_WAIT_STEP)
+            data = cache.get(key)
+            if data is not None:
+                return data
+        return None
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request, **kwargs)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        lock_key = f'{key}:lock'
+        locked = cache.add(
+            lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        )
+        if not locked:
+            data = self.wait_for(key)
+            if data is not None:
+                return Response(data)
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(
+                    key, response.data, settings.RESPONSE_CACHE_TIMEOUT
+                )
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -1,7 +1,216 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from hashlib import md5
+from json import JSONDecodeError, dumps, loads
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .caching import get_generation, relations_generation
+
+
+class CountPaginator(DjangoPaginator):
+    """Paginator Django, который считает объекты переданной функцией."""
+    def __init__(self, object_list, per_page, get_count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.get_count = get_count
+
+    @cached_property
+    def count(self):
+        return self.get_count()
 
 
 class PagePagination(PageNumberPagination):
-    """Пагинатор"""
+    """Пагинатор.
+
+    По умолчанию постраничный. С параметром `?cursor=` переключается
+    на курсор по ключу из `cursor_ordering` вьюсета: следующая страница
+    выбирается условием по последнему ключу, без `COUNT(*)` и `OFFSET`.
+
+    В постраничном режиме количество объектов кэшируется по тексту
+    запроса на `COUNT_CACHE_TIMEOUT` секунд. Для больших таблиц без
+    фильтров в PostgreSQL берётся оценка `reltuples`, в ответе это
+    отражает поле `count_exact`.
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-pk',)
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def django_paginator_class(self, queryset, per_page):
+        return CountPaginator(
+            queryset, per_page, lambda: self.get_count(queryset)
+        )
+
+    def get_count(self, queryset):
+        """Количество объектов: из кэша, оценка или точное."""
+        if not hasattr(queryset, 'query'):
+            return len(queryset)
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        signature = md5(f'{sql}{params}'.encode()).hexdigest()
+        model = queryset.model._meta.label_lower
+        key = (
+            f'count:{model}:{get_generation(model)}:'
+            f'{relations_generation(self.request.user)}:{signature}'
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            count, self.count_exact = cached
+            return count
+
+        count = None
+        if not queryset.query.where and not queryset.query.distinct:
+            count = self.estimate_count(queryset)
+        self.count_exact = count is None
+        if count is None:
+            count = queryset.count()
+        cache.set(
+            key, (count, self.count_exact), settings.COUNT_CACHE_TIMEOUT
+        )
+        return count
+
+    def estimate_count(self, queryset):
+        """Оценка числа строк таблицы по статистике PostgreSQL.
+
+        Возвращает `None`, если оценки нет или таблица небольшая.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                (queryset.model._meta.db_table,),
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < settings.COUNT_ESTIMATE_THRESHOLD:
+            return None
+        return row[0]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_exact = True
+        self.cursor_mode = (
+            self.cursor_query_param in request.query_params
+            and hasattr(queryset, 'query')
+        )
+        if not self.cursor_mode:
+            self.request = request
+            return super().paginate_queryset(queryset, request, view)
+
+        def fetch(position, limit):
+            ordered = queryset.order_by(*self.ordering)
+            if position:
+                ordered = ordered.filter(self.keyset_filter(position))
+            return ordered[:limit]
+
+        return self.paginate_keyset(fetch, request, view, queryset.model)
+
+    def paginate_keyset(self, fetch, request, view=None, model=None):
+        """Страница в режиме курсора из источника `fetch`.
+
+        `fetch(position, limit)` возвращает не больше `limit` объектов
+        после позиции курсора в порядке `cursor_ordering` вьюсета.
+        Значения позиции приведены к типам полей модели `model`,
+        по умолчанию - модели queryset вьюсета.
+        """
+        self.count_exact = True
+        self.cursor_mode = True
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.cursor_ordering)
+        if model is None:
+            model = view.queryset.model
+        position = self.decode_cursor(request, model)
+        page_size = self.get_page_size(request)
+        page = list(fetch(position, page_size + 1))
+        self.cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.cursor = self.encode_cursor(page[-1])
+        return page
+
+    def keyset_filter(self, position):
+        """Условие `(a, b, ...) после position` для порядка `ordering`."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, obj):
+        position = [
+            getattr(obj, field.lstrip('-')) for field in self.ordering
+        ]
+        return urlsafe_b64encode(
+            dumps(position, default=str).encode()
+        ).decode()
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = loads(urlsafe_b64decode(cursor.encode()))
+        except (DecodeError, JSONDecodeError, UnicodeDecodeError,
+                ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [
+                self.cursor_value(model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def cursor_value(self, model, name, value):
+        """Значение ключа курсора, приведённое к типу поля."""
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError(f'Неверное значение {name} в курсоре.')
+        if name == 'pk':
+            field = model._meta.pk
+        else:
+            field = model._meta.get_field(name)
+        value = field.to_python(value)
+        if value is None:
+            raise ValueError(f'Неверное значение {name} в курсоре.')
+        return value
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.cursor,
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            response = super().get_paginated_response(data)
+            response.data['count_exact'] = self.count_exact
+            return response
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,156 @@
+from django.contrib.auth import get_user_model
+from django.db import connections, router
+
+from recipes.models import Recipe
+
+User = get_user_model()
+
+RELATIONS = {
+    'is_subscribed': (User.subscribe.through, 'from_myuser', 'to_myuser'),
+    'is_favorited': (Recipe.favorites.through, 'myuser', 'recipe'),
+    'is_in_shopping_cart': (Recipe.cart.through, 'myuser', 'recipe'),
+}
+
+
+def relation_table(name):
+    """Соединение, таблица и столбцы промежуточной таблицы связи."""
+    model, user_field, object_field = RELATIONS[name]
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    return (
+        connection,
+        quote(model._meta.db_table),
+        quote(model._meta.get_field(user_field).column),
+        quote(model._meta.get_field(object_field).column),
+    )
+
+
+def add_relation(user, name, object_id):
+    """Создаёт связь `name` одним `INSERT ... ON CONFLICT DO NOTHING`.
+
+    Возвращает `True`, если строка добавлена. Если связь уже есть,
+    в том числе добавлена параллельным запросом, ничего не меняется.
+    """
+    connection, table, user_column, object_column = relation_table(name)
+    ops = connection.ops
+    sql = '{} {} ({}, {}) VALUES (%s, %s) {}'.format(
+        ops.insert_statement(ignore_conflicts=True),
+        table,
+        user_column,
+        object_column,
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (user.id, object_id))
+        return cursor.rowcount == 1
+
+
+def remove_relation(user, name, object_id):
+    """Удаляет связь `name` одним `DELETE`.
+
+    Возвращает `True`, если строка была удалена.
+    """
+    model, user_field, object_field = RELATIONS[name]
+    deleted, _ = model.objects.filter(
+        **{user_field: user, object_field: object_id}
+    ).delete()
+    return deleted > 0
+
+
+def add_relations(user, name, object_ids):
+    """Создаёт связи `name` с объектами одним `INSERT`.
+
+    Возвращает множество id, для которых строка действительно
+    добавлена. В PostgreSQL их возвращает `RETURNING`, в остальных
+    базах связи добавляются по одной через `add_relation`: результат
+    каждой вставки определяется числом строк, как и при одиночном
+    добавлении, поэтому параллельные запросы не учитывают связь дважды.
+    """
+    object_ids = set(object_ids)
+    if not object_ids:
+        return set()
+    connection, table, user_column, object_column = relation_table(name)
+    if connection.vendor != 'postgresql':
+        return {
+            object_id for object_id in object_ids
+            if add_relation(user, name, object_id)
+        }
+    values = ', '.join(['(%s, %s)'] * len(object_ids))
+    sql = (
+        f'INSERT INTO {table} ({user_column}, {object_column}) '
+        f'VALUES {values} ON CONFLICT DO NOTHING RETURNING {object_column}'
+    )
+    params = [
+        value for object_id in object_ids for value in (user.id, object_id)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def remove_relations(user, name, object_ids):
+    """Удаляет связи `name` с объектами одним `DELETE`.
+
+    Возвращает множество id, для которых строка действительно удалена.
+    В базах без `RETURNING` связи удаляются по одной через
+    `remove_relation`.
+    """
+    object_ids = set(object_ids)
+    if not object_ids:
+        return set()
+    connection, table, user_column, object_column = relation_table(name)
+    if connection.vendor != 'postgresql':
+        return {
+            object_id for object_id in object_ids
+            if remove_relation(user, name, object_id)
+        }
+    placeholders = ', '.join(['%s'] * len(object_ids))
+    sql = (
+        f'DELETE FROM {table} WHERE {user_column} = %s '
+        f'AND {object_column} IN ({placeholders}) RETURNING {object_column}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (user.id, *object_ids))
+        return {row[0] for row in cursor.fetchall()}
+
+
+class ViewerRelations:
+    """Снимок связей текущего пользователя на время запроса.
+
+    Для каждой связи хранит множество id, которые уже проверены,
+    и множество id, с которыми связь есть. Загружаются только id
+    объектов текущей страницы, по одному запросу на связь.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.checked = {name: set() for name in RELATIONS}
+        self.related = {name: set() for name in RELATIONS}
+
+    def load(self, name, ids):
+        """Загружает связь `name` для переданных id."""
+        ids = set(ids) - self.checked[name]
+        if not ids or self.user.is_anonymous:
+            return
+        model, user_field, object_field = RELATIONS[name]
+        self.related[name].update(
+            model.objects.filter(
+                **{user_field: self.user, f'{object_field}__in': ids}
+            ).values_list(f'{object_field}_id', flat=True)
+        )
+        self.checked[name].update(ids)
+
+    def has(self, name, object_id):
+        """Проверяет наличие связи `name` с объектом."""
+        if self.user.is_anonymous:
+            return False
+        self.load(name, (object_id,))
+        return object_id in self.related[name]
+
+
+def get_viewer_relations(request):
+    """Возвращает снимок связей, общий для всего запроса."""
+    relations = getattr(request, 'viewer_relations', None)
+    if relations is None:
+        relations = ViewerRelations(request.user)
+        request.viewer_relations = relations
+    return relations
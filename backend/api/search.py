@@ -0,0 +1,347 @@
+import logging
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import RLock
+from time import perf_counter
+
+import numpy as np
+
+from recipes.models import AmountIngredient, Ingredient, Recipe
+from recipes.utils import normalize_name
+from .caching import get_generation
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+INGREDIENTS = Ingredient._meta.label_lower
+COMPOSITION = 'recipes:composition'
+
+
+def ngrams(value, size=NGRAM_SIZE):
+    """Все подстроки длиной от 1 до `size` символов."""
+    return {
+        value[start:start + length]
+        for length in range(1, size + 1)
+        for start in range(len(value) - length + 1)
+    }
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Отсортированный массив имён отвечает на поиск по началу строки,
+    индекс n-грамм - на поиск по вхождению. Совпадения по началу
+    строки идут в выдаче первыми. Индекс строится при первом запросе
+    и дальше обновляется по сигналам модели `Ingredient`. Если версию
+    справочника поменял другой процесс, индекс строится заново.
+    """
+    def __init__(self):
+        self.lock = RLock()
+        self.built = False
+        self.generation = None
+        self.items = {}
+        self.names = []
+        self.grams = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+
+    def build(self, generation=None):
+        """Полностью перестраивает индекс по таблице ингредиентов."""
+        started = perf_counter()
+        ingredients = Ingredient.objects.values(
+            'id', 'name', 'measurement_unit', 'search_name'
+        )
+        with self.lock:
+            self.items = {}
+            self.names = []
+            self.grams = defaultdict(set)
+            for ingredient in ingredients.iterator():
+                self.names.append(self._add(ingredient))
+            self.names.sort()
+            self.built = True
+            self.generation = generation
+            self.rebuilds += 1
+            self.rebuild_time = perf_counter() - started
+        logger.info(
+            'Индекс ингредиентов построен: %s записей за %.3f с',
+            len(self.items), self.rebuild_time,
+        )
+
+    def invalidate(self):
+        """Сбрасывает индекс, он будет построен заново при поиске."""
+        with self.lock:
+            self.built = False
+
+    def _add(self, ingredient):
+        name = ingredient.pop('search_name')
+        self.items[ingredient['id']] = (name, ingredient)
+        for gram in ngrams(name):
+            self.grams[gram].add(ingredient['id'])
+        return name, ingredient['id']
+
+    def _remove(self, ingredient_id):
+        name, _ = self.items.pop(ingredient_id)
+        position = bisect_left(self.names, (name, ingredient_id))
+        del self.names[position]
+        for gram in ngrams(name):
+            self.grams[gram].discard(ingredient_id)
+            if not self.grams[gram]:
+                del self.grams[gram]
+
+    def is_current(self, generation):
+        """Проверяет, что с прошлой версии изменения были только у нас."""
+        if self.built and generation == self.generation + 1:
+            self.generation = generation
+            return True
+        self.built = False
+        return False
+
+    def update(self, ingredient, generation):
+        """Добавляет или обновляет ингредиент в построенном индексе."""
+        with self.lock:
+            if not self.is_current(generation):
+                return
+            if ingredient.id in self.items:
+                self._remove(ingredient.id)
+            insort(self.names, self._add({
+                'id': ingredient.id,
+                'name': ingredient.name,
+                'measurement_unit': ingredient.measurement_unit,
+                'search_name': ingredient.search_name,
+            }))
+
+    def remove(self, ingredient_id, generation):
+        """Удаляет ингредиент из построенного индекса."""
+        with self.lock:
+            if self.is_current(generation) and ingredient_id in self.items:
+                self._remove(ingredient_id)
+
+    def search(self, query):
+        """Ингредиенты, содержащие `query`: сначала по началу строки."""
+        query = normalize_name(query)
+        generation = get_generation(INGREDIENTS)
+        if not self.built or generation != self.generation:
+            self.build(generation)
+        with self.lock:
+            found = []
+            position = bisect_left(self.names, (query,))
+            while position < len(self.names):
+                name, ingredient_id = self.names[position]
+                if not name.startswith(query):
+                    break
+                found.append(ingredient_id)
+                position += 1
+            prefixed = set(found)
+
+            if len(query) <= NGRAM_SIZE:
+                grams = {query}
+            else:
+                grams = {
+                    query[start:start + NGRAM_SIZE]
+                    for start in range(len(query) - NGRAM_SIZE + 1)
+                }
+            candidates = set.intersection(
+                *(self.grams.get(gram, set()) for gram in grams)
+            )
+            contained = []
+            for ingredient_id in candidates - prefixed:
+                name = self.items[ingredient_id][0]
+                position = name.find(query)
+                if position >= 0:
+                    contained.append((position, name, ingredient_id))
+            contained.sort()
+            found.extend(ingredient_id for *_, ingredient_id in contained)
+            result = [self.items[ingredient_id][1] for ingredient_id in found]
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result
+
+    def stats(self):
+        """Метрики индекса."""
+        with self.lock:
+            return {
+                'size': len(self.items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'rebuilds': self.rebuilds,
+                'rebuild_time': self.rebuild_time,
+            }
+
+
+ingredient_index = IngredientIndex()
+
+
+class CompositionIndex:
+    """Обратный индекс ингредиентов рецептов в памяти процесса.
+
+    Каждому рецепту соответствует позиция, позиции идут по дате
+    публикации. Для ингредиента хранится массив позиций рецептов,
+    где он есть, для позиции - число ингредиентов рецепта. Совпадения
+    с набором ингредиентов считаются одним `bincount` по массивам
+    этих ингредиентов. Как и индекс ингредиентов, строится при первом
+    запросе и обновляется по сигналам, если версию состава рецептов
+    менял только этот процесс.
+    """
+    def __init__(self):
+        self.lock = RLock()
+        self.built = False
+        self.generation = None
+        self.positions = {}
+        self.recipe_ids = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int32)
+        self.recipes = {}
+        self.postings = {}
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+
+    def build(self, generation=None):
+        """Полностью перестраивает индекс по таблице ингредиентов."""
+        started = perf_counter()
+        recipe_ids = np.fromiter(
+            Recipe.objects.order_by('pub_date', 'id').values_list(
+                'id', flat=True
+            ).iterator(),
+            dtype=np.int64,
+        )
+        positions = {
+            recipe_id: position
+            for position, recipe_id in enumerate(recipe_ids.tolist())
+        }
+        recipes = defaultdict(list)
+        amounts = AmountIngredient.objects.values_list(
+            'recipe_id', 'ingredients_id'
+        )
+        for recipe_id, ingredient_id in amounts.iterator():
+            if recipe_id in positions:
+                recipes[positions[recipe_id]].append(ingredient_id)
+        postings = defaultdict(list)
+        counts = np.zeros(len(recipe_ids), dtype=np.int32)
+        for position, ingredient_ids in recipes.items():
+            counts[position] = len(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(position)
+        with self.lock:
+            self.positions = positions
+            self.recipe_ids = recipe_ids
+            self.counts = counts
+            self.recipes = {
+                position: frozenset(ingredient_ids)
+                for position, ingredient_ids in recipes.items()
+            }
+            self.postings = {
+                ingredient_id: np.array(found, dtype=np.int32)
+                for ingredient_id, found in postings.items()
+            }
+            self.built = True
+            self.generation = generation
+            self.rebuilds += 1
+            self.rebuild_time = perf_counter() - started
+        logger.info(
+            'Индекс состава рецептов построен: %s рецептов за %.3f с',
+            len(recipe_ids), self.rebuild_time,
+        )
+
+    def invalidate(self):
+        """Сбрасывает индекс, он будет построен заново при поиске."""
+        with self.lock:
+            self.built = False
+
+    def is_current(self, generation):
+        """Проверяет, что с прошлой версии изменения были только у нас."""
+        if self.built and generation == self.generation + 1:
+            self.generation = generation
+            return True
+        self.built = False
+        return False
+
+    def _remove(self, position):
+        for ingredient_id in self.recipes.pop(position, ()):
+            found = self.postings[ingredient_id]
+            self.postings[ingredient_id] = found[found != position]
+        self.counts[position] = 0
+
+    def update(self, recipe_id, generation):
+        """Обновляет состав рецепта в построенном индексе.
+
+        Новый рецепт получает следующую позицию, удалённый или
+        оставшийся без ингредиентов просто перестаёт находиться.
+        """
+        with self.lock:
+            if not self.is_current(generation):
+                return
+            ingredient_ids = frozenset(AmountIngredient.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredients_id', flat=True))
+            position = self.positions.get(recipe_id)
+            if position is not None:
+                self._remove(position)
+            if not ingredient_ids:
+                return
+            if position is None:
+                position = len(self.recipe_ids)
+                self.positions[recipe_id] = position
+                self.recipe_ids = np.append(self.recipe_ids, recipe_id)
+                self.counts = np.append(self.counts, 0).astype(np.int32)
+            self.recipes[position] = ingredient_ids
+            self.counts[position] = len(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                self.postings[ingredient_id] = np.append(
+                    self.postings.get(
+                        ingredient_id, np.empty(0, dtype=np.int32)
+                    ),
+                    np.int32(position),
+                )
+
+    def remove(self, recipe_id, generation):
+        """Убирает удалённый рецепт из построенного индекса."""
+        with self.lock:
+            if not self.is_current(generation):
+                return
+            position = self.positions.pop(recipe_id, None)
+            if position is not None:
+                self._remove(position)
+
+    def rank(self, ingredient_ids):
+        """Рецепты, где есть хотя бы один из ингредиентов.
+
+        Сначала рецепты, где не хватает меньше ингредиентов, затем
+        с большей долей имеющихся, затем новые. Возвращает id
+        рецептов и массивы совпавших и недостающих ингредиентов.
+        """
+        generation = get_generation(COMPOSITION)
+        if not self.built or generation != self.generation:
+            self.build(generation)
+        with self.lock:
+            found = [
+                self.postings[ingredient_id]
+                for ingredient_id in set(ingredient_ids)
+                if ingredient_id in self.postings
+            ]
+            if not found:
+                empty = np.empty(0, dtype=np.int64)
+                return empty, empty, empty
+            matched = np.bincount(
+                np.concatenate(found), minlength=len(self.counts)
+            )
+            positions = np.flatnonzero(matched)
+            matched = matched[positions]
+            counts = self.counts[positions]
+            recipe_ids = self.recipe_ids[positions]
+        missing = counts - matched
+        order = np.lexsort((-positions, -matched / counts, missing))
+        return recipe_ids[order], matched[order], missing[order]
+
+    def stats(self):
+        """Метрики индекса."""
+        return {
+            'size': len(self.recipes),
+            'rebuilds': self.rebuilds,
+            'rebuild_time': self.rebuild_time,
+        }
+
+
+composition_index = CompositionIndex()
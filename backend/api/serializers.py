@@ -1,15 +1,25 @@
+from collections import OrderedDict
 from string import hexdigits
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import F
-from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
+from django.utils.functional import cached_property
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 from rest_framework.serializers import ValidationError
 
 from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from recipes.signals import batch_touches, change_carts
+from .caching import get_generation
+from .fields import StreamingImageField
 from .mixins import GetIsSubscribedMixin
+from .relations import get_viewer_relations
+from .search import INGREDIENTS
 
 User = get_user_model()
 
@@ -45,11 +55,34 @@ class UserSerializer(serializers.ModelSerializer, GetIsSubscribedMixin):
         return user
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии картинки рецепта.
+
+    `{"thumbnail": {"webp": url, "jpg": url}, "card": ..., "full": ...}`,
+    пустой словарь, пока копии готовятся.
+    """
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = {}
+        for variant, files in variants.items():
+            if variant == 'source':
+                continue
+            urls[variant] = {}
+            for extension, name in files.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[variant][extension] = url
+        return urls
+
+
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Recipe."""
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = 'id', 'name', 'image', 'cooking_time'
+        fields = 'id', 'name', 'image', 'image_variants', 'cooking_time'
         read_only_fields = '__all__',
 
 
@@ -57,21 +90,19 @@ class UserSubscribeSerializer(UserSerializer):
     """Сериализатор вывода авторов на которых подписан текущий пользователь.
     """
     recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit:
+                recipes = recipes[:int(limit)]
         serializer = ShortRecipeSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        """ Показывает общее количество рецептов у каждого автора."""
-        return obj.recipes.count()
-
     class Meta:
         model = User
         fields = (
@@ -87,6 +118,19 @@ class UserSubscribeSerializer(UserSerializer):
         read_only_fields = '__all__',
 
 
+class BatchIdsSerializer(serializers.Serializer):
+    """Список id для пакетного изменения связей."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_IDS,
+    )
+
+    def validate_ids(self, ids):
+        """Убирает повторы, сохраняя порядок."""
+        return list(dict.fromkeys(ids))
+
+
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Tag"""
     class Meta:
@@ -156,8 +200,25 @@ class RecipeUserSerializer(
             'first_name', 'last_name', 'is_subscribed')
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: общая для всех часть берётся из кэша."""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        self.child.load_fragments(recipes)
+        return [self.child.to_representation(recipe) for recipe in recipes]
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
-    """Сериализатор для просмотра рецептов"""
+    """Сериализатор для просмотра рецептов
+
+    Всё, кроме `is_favorited`, `is_in_shopping_cart` и `is_subscribed`
+    автора, одинаково для всех пользователей. Эта часть хранится в кэше
+    по id и дате изменения рецепта, а отметки пользователя и счётчик
+    `favorites_count` добавляются к ней при каждом ответе. Теги,
+    ингредиенты и автор подгружаются только для рецептов, которых нет
+    в кэше.
+    """
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
     ingredients = AmountIngredientSerializer(
@@ -165,27 +226,122 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         required=True,
         source='ingredient')
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     is_in_shopping_cart = SerializerMethodField()
     is_favorited = SerializerMethodField()
 
+    prefetch = (
+        'tags',
+        Prefetch(
+            'ingredient',
+            queryset=AmountIngredient.objects.select_related('ingredients'),
+        ),
+        'author',
+    )
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'tags', 'author', 'ingredients',
-                  'image', 'text', 'cooking_time', 'is_favorited', 'is_in_shopping_cart')
+                  'image', 'image_variants', 'text', 'cooking_time',
+                  'favorites_count', 'is_favorited', 'is_in_shopping_cart')
+        list_serializer_class = RecipeListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fragments = {}
+
+    @cached_property
+    def catalog_version(self):
+        """Версии справочников тегов и ингредиентов."""
+        return '{}:{}'.format(
+            get_generation(Tag._meta.label_lower), get_generation(INGREDIENTS)
+        )
+
+    def fragment_key(self, recipe):
+        """Ключ общей части рецепта.
+
+        Ссылка на картинку абсолютная, поэтому в ключ входит хост.
+        """
+        request = self.context.get('request')
+        host = request.get_host() if request else ''
+        return 'recipe-fragment:{}:{}:{}:{}'.format(
+            recipe.id, recipe.updated_at.timestamp(), host,
+            self.catalog_version,
+        )
+
+    def load_fragments(self, recipes):
+        """Достаёт общие части одним запросом к кэшу, подгружает
+        данные для остальных рецептов и подписки на авторов страницы."""
+        keys = {self.fragment_key(recipe): recipe for recipe in recipes}
+        self.fragments = dict.fromkeys(keys)
+        self.fragments.update(cache.get_many(keys))
+        misses = [
+            recipe for key, recipe in keys.items()
+            if self.fragments[key] is None
+        ]
+        prefetch_related_objects(misses, *self.prefetch)
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            get_viewer_relations(request).load(
+                'is_subscribed', {recipe.author_id for recipe in recipes}
+            )
+
+    def get_fragment(self, recipe):
+        key = self.fragment_key(recipe)
+        if key in self.fragments:
+            fragment = self.fragments[key]
+        else:
+            fragment = cache.get(key)
+        if fragment is None:
+            prefetch_related_objects([recipe], *self.prefetch)
+            fragment = super().to_representation(recipe)
+            del fragment['is_favorited'], fragment['is_in_shopping_cart']
+            del fragment['favorites_count']
+            del fragment['author']['is_subscribed']
+            cache.set(key, fragment, settings.RECIPE_FRAGMENT_TIMEOUT)
+        return fragment
+
+    def to_representation(self, recipe):
+        data = OrderedDict(self.get_fragment(recipe))
+        data['author'] = OrderedDict(data['author'])
+        data['author']['is_subscribed'] = self.get_author_is_subscribed(
+            recipe
+        )
+        data['favorites_count'] = recipe.favorites_count
+        data['is_favorited'] = self.get_is_favorited(recipe)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(recipe)
+        return data
+
+    def get_author_is_subscribed(self, obj):
+        """Подписан ли пользователь на автора рецепта."""
+        user = self.context.get('request').user
+        if user.is_anonymous or obj.author_id == user.id:
+            return False
+        return get_viewer_relations(self.context.get('request')).has(
+            'is_subscribed', obj.author_id
+        )
     
     def get_is_in_shopping_cart(self, obj): 
         """Находится ли рецепт в списке  покупок.""" 
         user = self.context.get('request').user 
         if user.is_anonymous: 
             return False 
-        return user.carts.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return get_viewer_relations(self.context.get('request')).has(
+            'is_in_shopping_cart', obj.id
+        )
 
     def get_is_favorited(self, obj): 
         """Находится ли рецепт в избранном.""" 
         user = self.context.get('request').user 
         if user.is_anonymous: 
             return False 
-        return user.favorites.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return get_viewer_relations(self.context.get('request')).has(
+            'is_favorited', obj.id
+        )
 
     def get_ingredients(self, obj):
         """Получает список ингридиентов для рецепта."""
@@ -203,7 +359,7 @@ class RecepieWriteSerializer(serializers.ModelSerializer):
     author = serializers.ReadOnlyField(required=False)
     ingredients = IngredientsEditSerializer(
         many=True)
-    image = Base64ImageField()
+    image = StreamingImageField()
 
     class Meta:
         model = Recipe
@@ -229,72 +385,112 @@ class RecepieWriteSerializer(serializers.ModelSerializer):
         )
         return ingredients
 
-    def check_value_validate(self, value, klass=None): 
-        """Проверяет правильно ли передано значение.""" 
-        if not str(value).isdecimal(): 
-            raise ValidationError(f'{value} должно содержать цифру') 
-        if klass: 
-            obj = klass.objects.filter(id=value) 
-            if not obj: 
-                raise ValidationError( 
-                    f'Значения {value} не существует' 
-                ) 
-            return obj[0]
+    def check_value_validate(self, value):
+        """Проверяет правильно ли передано значение."""
+        if not str(value).isdecimal():
+            raise ValidationError(f'{value} должно содержать цифру')
 
     def validate(self, data):
-        """Проверка вводных данных при создании и редактировании рецепта. """
+        """Проверка вводных данных при создании и редактировании рецепта.
+
+        Все ингредиенты достаются одним запросом и сохраняются
+        в `data` для записи рецепта.
+        """
         ingredients = data['ingredients']
-        ingredient_list = []
-        for items in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient, id=items['id'])
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингредиент должен быть уникальным!')
-            ingredient_list.append(ingredient)
+        ids = [item['id'] for item in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиент должен быть уникальным!')
 
         tags = data['tags']
         if not tags:
             raise serializers.ValidationError(
                 'Нужен хотя бы один тэг для рецепта!')
 
-        valid_ingredients = []
-        for ing in ingredients:
-            ing_id = ing.get('id')
-            ingredient = self.check_value_validate(
-                ing_id, Ingredient)
-            amount = ing.get('amount')
-            self.check_value_validate(amount)
-
-            valid_ingredients.append(
-                {'ingredient': ingredient, 'amount': amount}
+        found = Ingredient.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            raise ValidationError(
+                f'Значения {", ".join(missing)} не существует'
             )
+        for item in ingredients:
+            self.check_value_validate(item['amount'])
+            item['ingredient'] = found[item['id']]
         return data
 
+    def search_ingredients(self, ingredients):
+        """Ингредиенты для полнотекстового поиска по рецептам."""
+        return ' '.join(item['ingredient'].search_name for item in ingredients)
+
     def recipe_amount_ingredients_write(self, recipe, ingredients):
         """Записывает ингредиенты вложенные в рецепт."""
         AmountIngredient.objects.bulk_create(
             [AmountIngredient(
                 recipe=recipe,
-                ingredients=get_object_or_404(Ingredient, id=ingr.get('id')),
-                amount=ingr.get('amount')) for ingr in ingredients])
-
+                ingredients=ingr['ingredient'],
+                amount=ingr['amount']) for ingr in ingredients])
+
+    def recipe_amount_ingredients_update(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к переданному списку.
+
+        Изменённые количества обновляются, новые ингредиенты добавляются,
+        убранные удаляются, остальные строки не трогаются. Возвращает
+        изменение количества по обновлённым и добавленным ингредиентам:
+        массовые запросы идут без сигналов, а удалённые строки списки
+        покупок пересчитывают сами.
+        """
+        existing = {
+            amount.ingredients_id: amount
+            for amount in AmountIngredient.objects.filter(recipe=recipe)
+        }
+        changes = {}
+        changed = []
+        created = []
+        for item in ingredients:
+            ingredient, value = item['ingredient'], item['amount']
+            amount = existing.pop(ingredient.id, None)
+            if amount is None:
+                created.append(AmountIngredient(
+                    recipe=recipe, ingredients=ingredient, amount=value
+                ))
+                changes[ingredient.id] = value
+            elif amount.amount != value:
+                changes[ingredient.id] = value - amount.amount
+                amount.amount = value
+                changed.append(amount)
+        AmountIngredient.objects.bulk_update(changed, ('amount',))
+        AmountIngredient.objects.bulk_create(created)
+        if existing:
+            with batch_touches():
+                AmountIngredient.objects.filter(
+                    id__in=[amount.id for amount in existing.values()]
+                ).delete()
+        return changes
+
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта."""
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.create(
+            **validated_data,
+            search_ingredients=self.search_ingredients(ingredients),
+        )
         recipe.tags.set(tags)
         self.recipe_amount_ingredients_write(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
         """Обновление рецепта."""
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe.tags.set(tags)
-        AmountIngredient.objects.filter(recipe=recipe).delete()
-        self.recipe_amount_ingredients_write(recipe, ingredients)
+        with batch_touches():
+            change_carts(recipe.id, self.recipe_amount_ingredients_update(
+                recipe, ingredients
+            ))
+        recipe.search_ingredients = self.search_ingredients(ingredients)
         return super().update(recipe, validated_data)
 
     def to_representation(self, instance):
@@ -0,0 +1,119 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from recipes.signals import data_imported
+from .caching import (RECIPE_RESPONSES, bump_generation,
+                      bump_relations_generation)
+from .search import (COMPOSITION, INGREDIENTS, composition_index,
+                     ingredient_index)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_index(sender, instance, **kwargs):
+    """Обновляет версию справочника и индекс автодополнения."""
+    ingredient_index.update(instance, bump_generation(INGREDIENTS))
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_from_ingredient_index(sender, instance, **kwargs):
+    """Обновляет версию справочника и удаляет ингредиент из индекса."""
+    ingredient_index.remove(instance.id, bump_generation(INGREDIENTS))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=AmountIngredient)
+@receiver(post_delete, sender=AmountIngredient)
+def update_composition_index(sender, instance, **kwargs):
+    """Обновляет состав рецепта в индексе после фиксации транзакции.
+
+    При создании рецепта через API ингредиенты записываются уже после
+    сохранения рецепта, к фиксации они есть в базе.
+    """
+    recipe_id = instance.id if sender is Recipe else instance.recipe_id
+    transaction.on_commit(lambda: composition_index.update(
+        recipe_id, bump_generation(COMPOSITION)
+    ))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_composition_index(sender, instance, **kwargs):
+    """Убирает удалённый рецепт из индекса состава."""
+    recipe_id = instance.id
+    transaction.on_commit(lambda: composition_index.remove(
+        recipe_id, bump_generation(COMPOSITION)
+    ))
+
+
+@receiver(post_save, sender=User)
+def bump_created_generation(sender, instance, created, **kwargs):
+    """Сбрасывает закэшированные количества при создании объекта."""
+    if created:
+        bump_generation(sender._meta.label_lower)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=AmountIngredient)
+@receiver(post_delete, sender=AmountIngredient)
+@receiver(post_save, sender=Ingredient)
+def bump_searched_recipes_generation(sender, **kwargs):
+    """Сбрасывает закэшированные количества рецептов при изменении
+    названия, описания или ингредиентов: от них зависят результаты
+    фильтра по названию и полнотекстового поиска."""
+    bump_generation(Recipe._meta.label_lower)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+def bump_deleted_generation(sender, instance, **kwargs):
+    """Сбрасывает закэшированные количества при удалении объекта."""
+    bump_generation(sender._meta.label_lower)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_tags_generation(sender, action, **kwargs):
+    """Смена тегов меняет количество рецептов в фильтре по тегам
+    и сами ответы со списками рецептов."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_generation(Recipe._meta.label_lower)
+        transaction.on_commit(lambda: bump_generation(RECIPE_RESPONSES))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_catalog_generation(sender, **kwargs):
+    """Меняет версию справочника тегов."""
+    bump_generation(sender._meta.label_lower)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=AmountIngredient)
+@receiver(post_delete, sender=AmountIngredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_recipe_responses(sender, **kwargs):
+    """Сбрасывает кэш ответов со списками и страницами рецептов.
+
+    Поколение меняется после фиксации транзакции, иначе параллельный
+    запрос успеет закэшировать данные до изменения.
+    """
+    transaction.on_commit(lambda: bump_generation(RECIPE_RESPONSES))
+
+
+@receiver(data_imported)
+def bump_imported_generations(sender, models, user_ids, **kwargs):
+    """Загрузка идёт пакетными запросами без сигналов моделей,
+    поэтому все затронутые кэши сбрасываются здесь."""
+    for model in models:
+        bump_generation(model._meta.label_lower)
+    bump_generation(RECIPE_RESPONSES)
+    bump_generation(COMPOSITION)
+    for user_id in user_ids:
+        bump_relations_generation(User(id=user_id))
@@ -0,0 +1,127 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from recipes.counters import recount_counters
+from .utils import client_for, create_catalog, create_recipes, create_user
+
+
+class RecipeConditionalGetTest(TestCase):
+    """ETag рецептов меняется вместе с данными ответа."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.tags, cls.ingredients = create_catalog(tags=1, ingredients=3)
+        cls.recipe, = create_recipes(
+            [cls.user], cls.tags, cls.ingredients, 1
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(self.user)
+        self.urls = ('/api/recipes/', f'/api/recipes/{self.recipe.id}/')
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def recipe_data(self, response):
+        if 'results' in response.data:
+            return response.data['results'][0]
+        return response.data
+
+    def test_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_tag_change(self):
+        tag = self.tags[0]
+        for number, url in enumerate(self.urls):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                tag.name = f'Новый тег {number}'
+                tag.save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    self.recipe_data(response)['tags'][0]['name'], tag.name
+                )
+
+    def test_tag_delete(self):
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        self.tags[0].delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], [])
+
+    def test_ingredient_change(self):
+        ingredient = self.recipe.ingredients.first()
+        for number, url in enumerate(self.urls):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                ingredient.name = f'Новое название {number}'
+                ingredient.save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                names = {
+                    item['name']
+                    for item in self.recipe_data(response)['ingredients']
+                }
+                self.assertIn(ingredient.name, names)
+
+    def test_favorites_count_change(self):
+        """Избранное другого пользователя меняет `favorites_count`
+        и порядок популярных рецептов."""
+        urls = (*self.urls, '/api/recipes/?sort=popular')
+        for number, url in enumerate(urls):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                other = client_for(create_user(f'fan{number}'))
+                response = other.post(
+                    f'/api/recipes/{self.recipe.id}/favorite/'
+                )
+                self.assertEqual(response.status_code, 201)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    self.recipe_data(response)['favorites_count'], number + 1
+                )
+
+    def test_anonymous_favorites_count(self):
+        """Ответ анониму кэшируется под своим ETag."""
+        anonymous = client_for()
+        url = self.urls[1]
+        self.assertEqual(anonymous.get(url).data['favorites_count'], 0)
+        response = self.client.post(f'{url}favorite/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(anonymous.get(url).data['favorites_count'], 1)
+
+    def test_unrelated_counters(self):
+        """Избранное другого рецепта и списки покупок не меняют ETag."""
+        other, = create_recipes(
+            [create_user('author')], self.tags, self.ingredients, 1
+        )
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        fan = client_for(create_user('fan'))
+        for path in (
+            f'/api/recipes/{other.id}/favorite/',
+            f'/api/recipes/{self.recipe.id}/shopping_cart/',
+        ):
+            self.assertEqual(fan.post(path).status_code, 201)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_orm_favorites_change(self):
+        """Пересчёт счётчика меняет ETag, только если счётчик изменился."""
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        recount_counters()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        create_user('fan').favorites.add(self.recipe)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['favorites_count'], 1)
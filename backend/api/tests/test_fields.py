@@ -0,0 +1,138 @@
+import os
+import struct
+import tracemalloc
+import zlib
+from base64 import b64encode
+from io import BytesIO
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from api import fields
+from api.fields import StreamingImageField
+
+
+def png(width, height, mode='RGB', data=None):
+    image = Image.new(mode, (width, height))
+    if data is not None:
+        image.frombytes(data)
+    buffer = BytesIO()
+    image.save(buffer, 'PNG', compress_level=0)
+    return buffer.getvalue()
+
+
+def png_header(width, height):
+    """PNG только с заголовком: размеры есть, пикселей нет."""
+    def chunk(kind, data):
+        return (
+            struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data))
+        )
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IEND', b'')
+    )
+
+
+def as_base64(data):
+    return 'data:image/png;base64,' + b64encode(data).decode()
+
+
+class StreamingImageFieldTest(SimpleTestCase):
+    """Проверки картинки до полного декодирования."""
+
+    def setUp(self):
+        self.field = StreamingImageField()
+
+    def assert_rejected(self, data, code):
+        with self.assertRaises(ValidationError) as context:
+            self.field.to_internal_value(data)
+        self.assertEqual(context.exception.detail[0].code, code)
+
+    def test_valid(self):
+        upload = self.field.to_internal_value(as_base64(png(4, 3)))
+        self.assertTrue(upload.name.endswith('.png'))
+        self.assertEqual(upload.content_type, 'image/png')
+        with Image.open(upload) as image:
+            self.assertEqual(image.size, (4, 3))
+
+    def test_not_base64(self):
+        self.assert_rejected('data:image/png;base64,не', 'invalid_image')
+        self.assert_rejected(42, 'invalid')
+
+    def test_not_image(self):
+        self.assert_rejected(as_base64(b'plain text'), 'invalid_image')
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1024)
+    def test_too_large(self):
+        self.assert_rejected(as_base64(os.urandom(2048)), 'too_large')
+
+    def test_too_many_pixels(self):
+        self.assert_rejected(
+            as_base64(png_header(8000, 6000)), 'too_many_pixels'
+        )
+
+    def test_decompression_bomb(self):
+        """Предел Pillow действует и при большем пределе в настройках."""
+        for width, height in ((15000, 13000), (10000, 10000)):
+            with self.subTest(size=(width, height)):
+                with override_settings(IMAGE_UPLOAD_MAX_PIXELS=10 ** 9):
+                    self.assert_rejected(
+                        as_base64(png_header(width, height)),
+                        'too_many_pixels',
+                    )
+
+    def test_file_closed_on_failure(self):
+        files = []
+        spooled = fields.SpooledTemporaryFile
+
+        def track(*args, **kwargs):
+            files.append(spooled(*args, **kwargs))
+            return files[-1]
+
+        payloads = (
+            as_base64(b'plain text'),
+            as_base64(png_header(8000, 6000)),
+            as_base64(png_header(15000, 13000)),
+            'data:image/png;base64,не base64',
+        )
+        with mock.patch.object(fields, 'SpooledTemporaryFile', track):
+            for data in payloads:
+                with self.assertRaises(ValidationError):
+                    self.field.to_internal_value(data)
+        self.assertEqual(len(files), len(payloads))
+        self.assertTrue(all(file.closed for file in files))
+
+
+class StreamingImageFieldMemoryTest(SimpleTestCase):
+    """Пик памяти при разборе картинки в несколько мегабайт.
+
+    Строка base64 уже в памяти, поэтому считается только память,
+    выделенная самим полем.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        width, height = 1200, 1000
+        cls.data = as_base64(
+            png(width, height, data=os.urandom(width * height * 3))
+        )
+
+    def peak(self, field):
+        tracemalloc.start()
+        try:
+            field.to_internal_value(self.data)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_peak_memory(self):
+        streaming = self.peak(StreamingImageField())
+        decoding = self.peak(Base64ImageField())
+        self.assertLess(streaming, len(self.data) // 2)
+        self.assertLess(streaming * 2, decoding)
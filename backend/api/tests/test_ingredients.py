@@ -0,0 +1,56 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from api.search import ingredient_index
+from recipes.models import Ingredient
+from .utils import client_for, create_user
+
+
+@override_settings(INGREDIENT_SEARCH_INDEX=True)
+class IngredientIndexTest(TestCase):
+    """Автодополнение ингредиентов из индекса в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Сахар', 'Сахарная пудра', 'Ванильный сахар', 'Соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        cls.admin = create_user('admin', is_staff=True)
+        cls.user = create_user('viewer')
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        response = client_for().get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_first(self):
+        self.assertEqual(
+            self.search('сах'),
+            ['Сахар', 'Сахарная пудра', 'Ванильный сахар'],
+        )
+
+    def test_follows_changes(self):
+        self.search('сах')
+        Ingredient.objects.create(name='Сахарный сироп', measurement_unit='мл')
+        Ingredient.objects.get(name='Соль').delete()
+        self.assertIn('Сахарный сироп', self.search('сахарн'))
+        self.assertEqual(self.search('соль'), [])
+
+    def test_stats(self):
+        before = client_for(self.admin).get('/api/ingredients/stats/').data
+        self.search('сах')
+        self.search('перец')
+        response = client_for(self.admin).get('/api/ingredients/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['size'], 4)
+        self.assertEqual(response.data['hits'], before['hits'] + 1)
+        self.assertEqual(response.data['misses'], before['misses'] + 1)
+        self.assertGreaterEqual(response.data['rebuilds'], 1)
+
+    def test_stats_for_admins_only(self):
+        for client in (client_for(), client_for(self.user)):
+            response = client.get('/api/ingredients/stats/')
+            self.assertIn(response.status_code, (401, 403))
@@ -0,0 +1,76 @@
+from base64 import urlsafe_b64encode
+from json import dumps
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from recipes.models import Recipe
+from .utils import client_for, create_catalog, create_recipes, create_user
+
+
+def encode(position):
+    return urlsafe_b64encode(dumps(position).encode()).decode()
+
+
+class CursorPaginationTest(TestCase):
+    """Режим курсора: обход страниц и неверные курсоры."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.authors = [create_user(f'author{number}') for number in range(3)]
+        tags, ingredients = create_catalog()
+        create_recipes(cls.authors, tags, ingredients, 25)
+        cls.user.subscribe.add(*cls.authors[:2])
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(self.user)
+
+    def walk(self, url):
+        ids = []
+        url = f'{url}?limit=4&cursor='
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_walk(self):
+        self.assertEqual(
+            self.walk('/api/recipes/'),
+            list(Recipe.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True
+            )),
+        )
+
+    def test_feed_walk(self):
+        self.assertEqual(
+            self.walk('/api/recipes/feed/'),
+            list(Recipe.objects.filter(
+                author__in=self.authors[:2]
+            ).order_by('-pub_date', '-id').values_list('id', flat=True)),
+        )
+
+    def test_invalid_cursor(self):
+        cursors = (
+            'not-base64!',
+            encode({'pub_date': 1}),
+            encode(['2026-01-01T00:00:00+00:00']),
+            encode(['notadate', 'x']),
+            encode(['2026-01-01T00:00:00+00:00', 'x']),
+            encode([None, 1]),
+            encode([[1], 1]),
+        )
+        for url in ('/api/recipes/', '/api/recipes/feed/'):
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404)
+
+    def test_users_invalid_cursor(self):
+        response = self.client.get(
+            '/api/users/', {'cursor': encode(['viewer', 'x'])}
+        )
+        self.assertEqual(response.status_code, 404)
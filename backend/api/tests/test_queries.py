@@ -0,0 +1,112 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from .utils import client_for, create_catalog, create_recipes, create_user
+
+PAGE_SIZES = (6, 50, 100)
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.authors = [create_user(f'author{number}') for number in range(5)]
+        tags, ingredients = create_catalog()
+        cls.recipes = create_recipes(cls.authors, tags, ingredients, 120)
+        cls.user.subscribe.add(*cls.authors[:2])
+        cls.user.favorites.add(*cls.recipes[:10])
+        cls.user.carts.add(*cls.recipes[5:15])
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(self.user)
+
+    def get_page(self, size):
+        response = self.client.get('/api/recipes/', {'limit': size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), size)
+        return response.data['results']
+
+    def test_cold_page(self):
+        """Без кэша: рецепты, теги, ингредиенты, авторы и связи."""
+        for size in PAGE_SIZES:
+            with self.subTest(size=size):
+                cache.clear()
+                with self.assertNumQueries(8):
+                    self.get_page(size)
+
+    def test_warm_page(self):
+        """Общие части рецептов берутся из кэша."""
+        for size in PAGE_SIZES:
+            with self.subTest(size=size):
+                cache.clear()
+                self.get_page(size)
+                with self.assertNumQueries(4):
+                    self.get_page(size)
+
+    def test_viewer_flags(self):
+        results = self.get_page(100)
+        favorited = {recipe.id for recipe in self.recipes[:10]}
+        in_cart = {recipe.id for recipe in self.recipes[5:15]}
+        authors = {author.id for author in self.authors[:2]}
+        for recipe in results:
+            self.assertEqual(recipe['is_favorited'], recipe['id'] in favorited)
+            self.assertEqual(
+                recipe['is_in_shopping_cart'], recipe['id'] in in_cart
+            )
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] in authors,
+            )
+
+    def test_detail(self):
+        """Рецепт без кэша: как страница, но без подсчёта количества."""
+        recipe = self.recipes[0]
+        with self.assertNumQueries(7):
+            response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertEqual(len(response.data['ingredients']), 3)
+
+
+class UserListQueriesTest(TestCase):
+    """Подписки и список пользователей не запрашивают базу по строке."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.authors = [
+            create_user(f'author{number:02}') for number in range(30)
+        ]
+        tags, ingredients = create_catalog()
+        create_recipes(cls.authors, tags, ingredients, 90)
+        cls.user.subscribe.add(*cls.authors)
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(self.user)
+
+    def test_subscriptions(self):
+        for size in (6, 30):
+            with self.subTest(size=size):
+                cache.clear()
+                with self.assertNumQueries(4):
+                    response = self.client.get(
+                        '/api/users/subscriptions/',
+                        {'limit': size, 'recipes_limit': 2},
+                    )
+                self.assertEqual(len(response.data['results']), size)
+                for author in response.data['results']:
+                    self.assertTrue(author['is_subscribed'])
+                    self.assertEqual(author['recipes_count'], 3)
+                    self.assertEqual(len(author['recipes']), 2)
+
+    def test_users(self):
+        for size in (6, 30):
+            with self.subTest(size=size):
+                cache.clear()
+                with self.assertNumQueries(4):
+                    response = self.client.get('/api/users/', {'limit': size})
+                self.assertEqual(len(response.data['results']), size)
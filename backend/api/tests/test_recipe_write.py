@@ -0,0 +1,216 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from recipes.cart import expected_cart_totals
+from recipes.models import AmountIngredient, CartIngredient, Recipe
+from .utils import client_for, create_catalog, create_user
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+# Запросы записи рецепта вместе с ответом, не зависят от числа
+# ингредиентов.
+MAX_CREATE_QUERIES = 17
+MAX_UPDATE_QUERIES = 22
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeWriteTest(TestCase):
+    """Запись рецепта: число запросов и изменение ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.buyers = [create_user(f'buyer{number}') for number in range(2)]
+        cls.tags, cls.ingredients = create_catalog(ingredients=40)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(self.author)
+
+    def payload(self, amounts, name='Рецепт'):
+        """Данные рецепта, `amounts` - {номер ингредиента: количество}."""
+        return {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tags[0].id],
+            'ingredients': [
+                {'id': self.ingredients[number].id, 'amount': amount}
+                for number, amount in amounts.items()
+            ],
+        }
+
+    def create(self, amounts, name='Рецепт'):
+        response = self.client.post(
+            '/api/recipes/', self.payload(amounts, name), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return Recipe.objects.get(id=response.data['id'])
+
+    def update(self, recipe, amounts):
+        response = self.client.put(
+            f'/api/recipes/{recipe.id}/',
+            self.payload(amounts, recipe.name),
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def amounts(self, recipe):
+        return dict(AmountIngredient.objects.filter(
+            recipe=recipe
+        ).values_list('ingredients', 'amount'))
+
+    def cart_totals(self, user):
+        return dict(CartIngredient.objects.filter(
+            user=user
+        ).values_list('ingredient', 'total_amount'))
+
+    def queries(self, action, *args):
+        with CaptureQueriesContext(connection) as context:
+            action(*args)
+        return len(context)
+
+    def amount_writes(self, action, *args):
+        """Запросы, изменяющие строки ингредиентов рецептов."""
+        table = AmountIngredient._meta.db_table
+        with CaptureQueriesContext(connection) as context:
+            action(*args)
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            and table in query['sql']
+        ]
+
+    def test_create_queries(self):
+        """Число запросов не зависит от числа ингредиентов."""
+        few = self.queries(self.create, {0: 1, 1: 1}, 'Мало')
+        many = self.queries(
+            self.create, dict.fromkeys(range(30), 1), 'Много'
+        )
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, MAX_CREATE_QUERIES)
+
+    def test_update_queries(self):
+        few = self.create({0: 1, 1: 1}, 'Мало')
+        many = self.create(dict.fromkeys(range(30), 1), 'Много')
+        few_queries = self.queries(self.update, few, {0: 2, 2: 1})
+        many_queries = self.queries(
+            self.update, many, {**dict.fromkeys(range(1, 30), 2), 35: 1}
+        )
+        self.assertEqual(few_queries, many_queries)
+        self.assertLessEqual(many_queries, MAX_UPDATE_QUERIES)
+
+    def test_diff(self):
+        recipe = self.create({0: 100, 1: 200, 2: 300})
+        kept = AmountIngredient.objects.get(
+            recipe=recipe, ingredients=self.ingredients[0]
+        ).id
+        for buyer in self.buyers:
+            response = client_for(buyer).post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 201)
+
+        writes = self.amount_writes(
+            self.update, recipe, {0: 100, 1: 250, 3: 50}
+        )
+        self.assertEqual(
+            sorted(sql.split()[0] for sql in writes),
+            ['DELETE', 'INSERT', 'UPDATE'],
+        )
+        ids = self.ingredients
+        expected = {ids[0].id: 100, ids[1].id: 250, ids[3].id: 50}
+        self.assertEqual(self.amounts(recipe), expected)
+        self.assertEqual(
+            AmountIngredient.objects.get(
+                recipe=recipe, ingredients=ids[0]
+            ).id,
+            kept,
+        )
+        for buyer in self.buyers:
+            self.assertEqual(self.cart_totals(buyer), expected)
+        self.assertEqual(
+            set(expected_cart_totals()),
+            set(CartIngredient.objects.values_list(
+                'user', 'ingredient', 'total_amount'
+            )),
+        )
+
+    def test_unchanged_ingredients(self):
+        """Правка без изменения ингредиентов их не трогает."""
+        recipe = self.create({0: 1, 1: 2})
+        before = list(AmountIngredient.objects.filter(
+            recipe=recipe
+        ).order_by('id').values_list('id', 'ingredients', 'amount'))
+        self.assertEqual(
+            self.amount_writes(self.update, recipe, {0: 1, 1: 2}), []
+        )
+        after = list(AmountIngredient.objects.filter(
+            recipe=recipe
+        ).order_by('id').values_list('id', 'ingredients', 'amount'))
+        self.assertEqual(before, after)
+
+    def test_invalid_ingredients(self):
+        payload = self.payload({0: 1})
+        for ingredients in (
+            [{'id': self.ingredients[0].id, 'amount': 1}] * 2,
+            [{'id': 10 ** 6, 'amount': 1}],
+        ):
+            with self.subTest(ingredients=ingredients):
+                payload['ingredients'] = ingredients
+                response = self.client.post(
+                    '/api/recipes/', payload, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_orm_changes(self):
+        """Ингредиенты, изменённые через ORM, попадают в списки покупок."""
+        recipe = self.create({0: 100, 1: 200}, 'Первый')
+        other = self.create({0: 10}, 'Второй')
+        for buyer in self.buyers:
+            for item in (recipe, other):
+                response = client_for(buyer).post(
+                    f'/api/recipes/{item.id}/shopping_cart/'
+                )
+                self.assertEqual(response.status_code, 201)
+
+        def assert_totals():
+            self.assertEqual(
+                set(CartIngredient.objects.values_list(
+                    'user', 'ingredient', 'total_amount'
+                )),
+                set(expected_cart_totals()),
+            )
+
+        amount = AmountIngredient.objects.create(
+            recipe=recipe, ingredients=self.ingredients[2], amount=30
+        )
+        assert_totals()
+        amount.amount = 40
+        amount.save()
+        assert_totals()
+        amount.ingredients = self.ingredients[3]
+        amount.save()
+        assert_totals()
+        amount.delete()
+        assert_totals()
+        recipe.delete()
+        assert_totals()
+        self.assertEqual(
+            self.cart_totals(self.buyers[0]), {self.ingredients[0].id: 10}
+        )
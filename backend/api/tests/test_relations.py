@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase
+
+from recipes.cart import expected_cart_totals
+from recipes.counters import counter_drift
+from recipes.models import CartIngredient, Recipe
+from .utils import client_for, create_catalog, create_recipes, create_user
+
+THREADS = 6
+MISSING = 10 ** 6
+
+
+class ToggleConflictTest(TransactionTestCase):
+    """Повторные и параллельные добавления и удаления связей.
+
+    Ответ определяется числом изменённых строк, поэтому повтор
+    получает 400, а счётчики и списки покупок меняются один раз.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        tags, ingredients = create_catalog(ingredients=5)
+        self.recipe, = create_recipes([self.author], tags, ingredients, 1)
+        self.client = client_for(self.user)
+        self.urls = {
+            'favorite': f'/api/recipes/{self.recipe.id}/favorite/',
+            'shopping_cart': f'/api/recipes/{self.recipe.id}/shopping_cart/',
+            'subscribe': f'/api/users/{self.author.id}/subscribe/',
+        }
+
+    def assert_consistent(self):
+        self.assertEqual(list(counter_drift()), [])
+        self.assertEqual(
+            set(expected_cart_totals()),
+            set(CartIngredient.objects.values_list(
+                'user', 'ingredient', 'total_amount'
+            )),
+        )
+
+    def counters(self):
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        self.author.refresh_from_db()
+        return (
+            recipe.favorites_count,
+            recipe.in_carts_count,
+            self.author.subscribers_count,
+        )
+
+    def test_repeated(self):
+        for name, url in self.urls.items():
+            with self.subTest(relation=name):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assert_consistent()
+        for name, url in self.urls.items():
+            with self.subTest(relation=name):
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.counters(), (0, 0, 0))
+        self.assertFalse(CartIngredient.objects.exists())
+        self.assert_consistent()
+
+    def test_missing_object(self):
+        for url in (
+            '/api/recipes/0/favorite/',
+            '/api/recipes/0/shopping_cart/',
+            '/api/users/0/subscribe/',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url).status_code, 404)
+                self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def parallel(self, method, url):
+        """Статусы `THREADS` одновременных запросов."""
+        barrier = Barrier(THREADS)
+
+        def request(_):
+            client = client_for(self.user)
+            barrier.wait()
+            try:
+                return getattr(client, method)(url).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(THREADS) as executor:
+            return sorted(executor.map(request, range(THREADS)))
+
+    def test_parallel(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не ждёт блокировок таблиц')
+        for name, url in self.urls.items():
+            with self.subTest(relation=name):
+                self.assertEqual(
+                    self.parallel('post', url),
+                    [201] + [400] * (THREADS - 1),
+                )
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assert_consistent()
+        for name, url in self.urls.items():
+            with self.subTest(relation=name):
+                self.assertEqual(
+                    self.parallel('delete', url),
+                    [204] + [400] * (THREADS - 1),
+                )
+        self.assertEqual(self.counters(), (0, 0, 0))
+        self.assert_consistent()
+
+
+class BatchToggleTest(ToggleConflictTest):
+    """Пакетные добавления и удаления связей."""
+
+    def setUp(self):
+        super().setUp()
+        self.urls = {
+            'favorite': '/api/recipes/favorite/batch/',
+            'shopping_cart': '/api/recipes/shopping_cart/batch/',
+            'subscribe': '/api/users/subscribe/batch/',
+        }
+        self.ids = {
+            'favorite': [self.recipe.id, MISSING],
+            'shopping_cart': [self.recipe.id, MISSING],
+            'subscribe': [self.author.id, self.user.id],
+        }
+
+    def send(self, method, name, client=None):
+        """Статусы пакетного запроса по id."""
+        response = getattr(client or self.client, method)(
+            self.urls[name], {'ids': self.ids[name]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [result['status'] for result in response.data['results']]
+
+    def test_repeated(self):
+        for name in self.urls:
+            with self.subTest(relation=name):
+                self.assertEqual(
+                    self.send('post', name), ['added', 'not_found']
+                )
+                self.assertEqual(
+                    self.send('post', name), ['unchanged', 'not_found']
+                )
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assertFalse(self.user.subscribe.filter(id=self.user.id).exists())
+        self.assert_consistent()
+        for name in self.urls:
+            with self.subTest(relation=name):
+                self.assertEqual(
+                    self.send('delete', name), ['removed', 'not_found']
+                )
+                self.assertEqual(
+                    self.send('delete', name), ['unchanged', 'not_found']
+                )
+        self.assertEqual(self.counters(), (0, 0, 0))
+        self.assertFalse(CartIngredient.objects.exists())
+        self.assert_consistent()
+
+    def test_missing_object(self):
+        self.ids = dict.fromkeys(self.ids, [MISSING])
+        for name in self.urls:
+            with self.subTest(relation=name):
+                self.assertEqual(self.send('post', name), ['not_found'])
+
+    def parallel(self, method, name):
+        """Статусы первого id в `THREADS` одновременных запросах."""
+        barrier = Barrier(THREADS)
+
+        def request(_):
+            client = client_for(self.user)
+            barrier.wait()
+            try:
+                return self.send(method, name, client)[0]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(THREADS) as executor:
+            return sorted(executor.map(request, range(THREADS)))
+
+    def test_parallel(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не ждёт блокировок таблиц')
+        for name in self.urls:
+            with self.subTest(relation=name):
+                self.assertEqual(
+                    self.parallel('post', name),
+                    ['added'] + ['unchanged'] * (THREADS - 1),
+                )
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assert_consistent()
+        for name in self.urls:
+            with self.subTest(relation=name):
+                self.assertEqual(
+                    self.parallel('delete', name),
+                    ['removed'] + ['unchanged'] * (THREADS - 1),
+                )
+        self.assertEqual(self.counters(), (0, 0, 0))
+        self.assert_consistent()
@@ -0,0 +1,37 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from .utils import client_for, create_catalog, create_recipes, create_user
+
+
+class SubscriptionsRecipesLimitTest(TestCase):
+    """Параметр `recipes_limit` страницы подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.authors = [create_user(f'author{number}') for number in range(3)]
+        tags, ingredients = create_catalog()
+        create_recipes(cls.authors, tags, ingredients, 12)
+        cls.user.subscribe.add(*cls.authors)
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(self.user)
+
+    def get_previews(self, **params):
+        response = self.client.get('/api/users/subscriptions/', params)
+        self.assertEqual(response.status_code, 200)
+        return [author['recipes'] for author in response.data['results']]
+
+    def test_without_limit(self):
+        for recipes in self.get_previews():
+            self.assertEqual(len(recipes), 4)
+
+    def test_limit(self):
+        for recipes in self.get_previews(recipes_limit=2):
+            self.assertEqual(len(recipes), 2)
+
+    def test_zero_limit(self):
+        for recipes in self.get_previews(recipes_limit=0):
+            self.assertEqual(recipes, [])
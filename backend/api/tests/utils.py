@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+IMAGE = 'recipe_images/test.png'
+
+
+def create_user(username, **kwargs):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password',
+        first_name='Имя',
+        last_name='Фамилия',
+        **kwargs,
+    )
+
+
+def create_catalog(tags=3, ingredients=20):
+    """Теги и ингредиенты для рецептов."""
+    return (
+        [
+            Tag.objects.create(
+                name=f'Тег {number}', slug=f'tag{number}', color='#FFFFFF'
+            )
+            for number in range(tags)
+        ],
+        [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(ingredients)
+        ],
+    )
+
+
+def create_recipes(authors, tags, ingredients, count, per_recipe=3):
+    """Рецепты авторов по кругу с тегами и ингредиентами.
+
+    Копии картинки помечены готовыми, чтобы сохранение рецепта
+    не запускало их подготовку.
+    """
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            name=f'Рецепт {number}',
+            author=authors[number % len(authors)],
+            text='Описание',
+            cooking_time=10,
+            image=IMAGE,
+            image_variants={'source': IMAGE},
+        )
+        recipe.tags.set(tags[:1 + number % len(tags)])
+        AmountIngredient.objects.bulk_create(
+            AmountIngredient(
+                recipe=recipe,
+                ingredients=ingredients[(number + shift) % len(ingredients)],
+                amount=shift + 1,
+            )
+            for shift in range(per_recipe)
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+def client_for(user=None):
+    """Клиент API, по умолчанию анонимный."""
+    client = APIClient()
+    if user is not None:
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
@@ -1,95 +1,284 @@
+from collections import defaultdict
+from hashlib import md5
 from urllib.parse import unquote
 
-from django.db.models import F, Q, Sum
-from django.http.response import HttpResponse
-from django.utils import timezone
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import (BooleanField, Case, Count, Exists, F,
+                              IntegerField, Max, OuterRef, Sum, Value, When,
+                              Window)
+from django.db.models.functions import RowNumber
+from django.http.response import StreamingHttpResponse
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
-from .mixins import AddDelViewMixin
+from recipes.feed import feed_page
+from recipes.fulltext import search_recipes
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.utils import normalize_name
+from .caching import RECIPE_RESPONSES, get_generation, relations_generation
+from .exports import export_shopping_list
+from .mixins import (AddDelViewMixin, AnonymousCacheMixin, CachedListMixin,
+                     ConditionalGetMixin, ViewerRelationsMixin)
 from .paginators import PagePagination
 from .permissions import AdminAuthorOrReadOnly, AdminOrReadOnly
-from .serializers import (IngredientSerializer, RecepieWriteSerializer,
+from .renderers import CSVRenderer, TextRenderer
+from .search import INGREDIENTS, composition_index, ingredient_index
+from .serializers import (BatchIdsSerializer, IngredientSerializer,
+                          RecepieWriteSerializer, RecipeReadSerializer,
                           ShortRecipeSerializer, TagSerializer,
                           UserSubscribeSerializer)
 
-DATE_FORMAT = '%d-%m-%Y %H:%M'
+User = get_user_model()
+
 ADD_METHODS = ('GET', 'POST',)
 DEL_METHODS = ('DELETE',)
 
 IN_CART = ('1', 'true',)
 NOT_IN_CART = ('0', 'false',)
 
+RECIPE_ORDERING = ('-pub_date', '-id')
+POPULAR_ORDERING = ('-favorites_count', '-pub_date', '-id')
+
+
+def set_recipes_preview(authors, limit=None):
+    """Добавляет авторам первые `limit` рецептов одним запросом.
+
+    Рецепты нумеруются оконной функцией `ROW_NUMBER()` в разрезе автора,
+    поэтому количество запросов не зависит от числа авторов на странице.
+    Без `limit` добавляются все рецепты, `limit=0` оставляет список пустым.
+    """
+    recipes = Recipe.objects.filter(author__in=authors).only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author'
+    )
+    if limit is not None:
+        recipes = recipes.order_by().annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        )
+        sql, params = recipes.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) preview '
+            'WHERE row_number <= %s ORDER BY row_number',
+            (*params, limit),
+        )
+    previews = defaultdict(list)
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipes_preview = previews[author.id]
+
 
-class UserViewSet(DjoserUserViewSet, AddDelViewMixin):
+class UserViewSet(ViewerRelationsMixin, DjoserUserViewSet, AddDelViewMixin):
     """Вьюсет для пользователей."""
     pagination_class = PagePagination
     add_serializer = UserSubscribeSerializer
+    batch_serializer = BatchIdsSerializer
+    viewer_relations = ('is_subscribed',)
+    cursor_ordering = ('username', 'id')
 
     @action(methods=('get', 'post', 'delete',), detail=True)
     def subscribe(self, request, id):
         """Создаёт и удалет связь между пользователями."""
         return self.add_del_method(id, 'subscribers')
 
+    @action(
+        methods=('post', 'delete',), detail=False, url_path='subscribe/batch'
+    )
+    def subscribe_batch(self, request):
+        """Подписывает на нескольких авторов или отписывает от них."""
+        return self.add_del_batch('subscribers')
+
     @action(methods=('get',), detail=False)
     def subscriptions(self, request):
         """Подписки пользоваетеля."""
         user = self.request.user
         if user.is_anonymous:
             return Response(status=HTTP_401_UNAUTHORIZED)
-        authors = user.subscribe.all()
+        authors = user.subscribe.annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('username')
         pages = self.paginate_queryset(authors)
+        limit = request.query_params.get('recipes_limit', '')
+        set_recipes_preview(
+            pages, int(limit) if limit.isdecimal() else None
+        )
         serializer = UserSubscribeSerializer(
             pages, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class CatalogViewSet(ConditionalGetMixin, CachedListMixin,
+                     ReadOnlyModelViewSet):
+    """Справочник, который почти не меняется.
+
+    Версия справочника хранится в кэше и меняется по сигналам модели.
+    По ней строится ETag для условных запросов и пересобирается
+    готовый JSON полного списка.
+    """
+    permission_classes = (AdminOrReadOnly,)
+
+    def get_validators(self, request, *args, **kwargs):
+        label = self.queryset.model._meta.label_lower
+        etag = md5(
+            f'{label}:{get_generation(label)}:{request.get_full_path()}'
+            .encode()
+        ).hexdigest()
+        return etag, None
+
+
+class TagViewSet(CatalogViewSet):
     """Вьюсет для тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_classes = (AdminOrReadOnly,)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogViewSet):
     """Вьюсет для ингредиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    permission_classes = (AdminOrReadOnly,)
 
-    def get_queryset(self):
-        """Получает queryset в соответствии с параметрами запроса."""
+    def filter_queryset(self, queryset):
+        """Поиск по названию отдаётся из индекса в памяти процесса."""
         name = self.request.query_params.get('name')
-        queryset = self.queryset
-        if name:
-            if name[0] == '%':
-                name = unquote(name)
-            name = name.lower()
-            stw_queryset = queryset.filter(
-                Q(name__startswith=name) & Q(name__contains=name))
-        return stw_queryset
+        if self.action != 'list' or not name:
+            return super().filter_queryset(queryset)
+        if name[0] == '%':
+            name = unquote(name)
+        if settings.INGREDIENT_SEARCH_INDEX:
+            return ingredient_index.search(name)
+        return self.search_queryset(name)
+
+    @action(
+        methods=('get',), detail=False, permission_classes=(IsAdminUser,)
+    )
+    def stats(self, request):
+        """Размер индекса автодополнения в этом процессе, число
+        поисков с результатом и без, число и время перестроек."""
+        return Response(ingredient_index.stats())
 
+    def search_queryset(self, name):
+        """Поиск по нормализованному названию в базе данных.
+
+        Совпадения по началу строки идут первыми.
+        """
+        name = normalize_name(name)
+        return self.queryset.filter(search_name__contains=name).annotate(
+            rank=Case(
+                When(search_name__startswith=name, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('rank', 'search_name')
 
-class RecipeViewSet(ModelViewSet, AddDelViewMixin):
+
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin, ModelViewSet,
+                    AddDelViewMixin):
     """Вьюсет для работы с рецептами."""
     queryset = Recipe.objects.select_related('author')
     serializer_class = RecepieWriteSerializer
     permission_classes = (AdminAuthorOrReadOnly,)
     pagination_class = PagePagination
     add_serializer = ShortRecipeSerializer
+    batch_serializer = BatchIdsSerializer
+    cache_generation = RECIPE_RESPONSES
+    cache_params = (
+        'tags', 'author', 'name', 'search', 'sort', 'page', 'limit', 'cursor'
+    )
+
+    @property
+    def cursor_ordering(self):
+        """Ключ курсора совпадает с порядком списка."""
+        if (self.action == 'list'
+                and self.request.query_params.get('sort') == 'popular'):
+            return POPULAR_ORDERING
+        return RECIPE_ORDERING
 
     def perform_create(self, serializer):
         """Переопределение метода создания рецепта"""
         serializer.save(author=self.request.user)
 
+    def get_serializer_class(self):
+        """Для чтения используется отдельный сериализатор."""
+        if self.request.method in SAFE_METHODS:
+            return RecipeReadSerializer
+        return self.serializer_class
+
+    def get_read_queryset(self):
+        """Queryset для `RecipeReadSerializer`.
+
+        Отметки `is_favorited` и `is_in_shopping_cart` вычисляются через
+        `Exists()`. Теги, ингредиенты и автора сериализатор подгружает
+        сам и только для рецептов, которых нет в кэше.
+        """
+        queryset = Recipe.objects.all()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+
+        favorited = Recipe.favorites.through.objects.filter(
+            myuser=user, recipe=OuterRef('pk')
+        )
+        in_cart = Recipe.cart.through.objects.filter(
+            myuser=user, recipe=OuterRef('pk')
+        )
+        return queryset.annotate(
+            is_favorited=Exists(favorited),
+            is_in_shopping_cart=Exists(in_cart),
+        )
+
+    def get_validators(self, request, *args, **kwargs):
+        """Валидаторы рецепта или страницы списка.
+
+        Учитывают дату изменения рецептов, их количество, сумму версий
+        счётчиков избранного, параметры запроса, версии справочников
+        тегов и ингредиентов и версию связей пользователя с рецептами
+        и авторами. `Last-Modified` не отдаётся: счётчик избранного
+        меняется без изменения даты рецепта.
+        """
+        recipes = Recipe.objects.all()
+        if self.action == 'retrieve':
+            if not str(kwargs.get('pk')).isdecimal():
+                return None, None
+            recipes = recipes.filter(pk=kwargs['pk'])
+        else:
+            recipes = self.filter_recipes(recipes)
+        state = recipes.aggregate(
+            last=Max('updated_at'),
+            count=Count('id'),
+            favorites=Sum('favorites_version'),
+        )
+        if not state['count']:
+            return None, None
+        user = request.user
+        etag = md5(
+            f'{request.get_full_path()}:{state["last"].isoformat()}:'
+            f'{state["count"]}:{state["favorites"]}:'
+            f'{get_generation(Tag._meta.label_lower)}:'
+            f'{get_generation(INGREDIENTS)}:{user.id}:'
+            f'{relations_generation(user)}'.encode()
+        ).hexdigest()
+        return etag, None
+
     def get_queryset(self):
         """Получает queryset в соответствии с параметрами запроса."""
         queryset = self.queryset
+        if self.request.method in SAFE_METHODS:
+            queryset = self.get_read_queryset()
+        return self.filter_recipes(queryset)
+
+    def filter_recipes(self, queryset):
+        """Фильтрует рецепты по параметрам запроса."""
         tags = self.request.query_params.getlist('tags')
         if tags:
             queryset = queryset.filter(
@@ -99,6 +288,19 @@ class RecipeViewSet(ModelViewSet, AddDelViewMixin):
         if author:
             queryset = queryset.filter(author=author)
 
+        name = self.request.query_params.get('name')
+        if name:
+            queryset = queryset.filter(
+                search_name__contains=normalize_name(name)
+            )
+
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = search_recipes(queryset, search)
+
+        if self.request.query_params.get('sort') == 'popular':
+            queryset = queryset.order_by(*POPULAR_ORDERING)
+
         user = self.request.user
         if user.is_anonymous:
             return queryset
@@ -127,31 +329,140 @@ class RecipeViewSet(ModelViewSet, AddDelViewMixin):
         return self.add_del_method(pk, 'shopping_cart')
 
     @action(methods=('get',), detail=False)
-    def download_shopping_cart(self, request):
-        """Загружает файл *.txt со списком покупок."""
-        user = self.request.user
-        if not user.carts.exists():
-            return Response(status=HTTP_400_BAD_REQUEST)
-        ingredients = AmountIngredient.objects.filter(
-            recipe__in=(user.carts.values('id'))
-        ).values(
-            ingredient=F('ingredients__name'),
-            measure=F('ingredients__measurement_unit')
-        ).annotate(quantity=Sum('amount'))
-        filename = f'{user.username}_shopping_list.txt'
-        shopping_list = (
-            f'Список покупок для:\n\n{user.first_name}\n'
-            f'{timezone.now().strftime(DATE_FORMAT)}\n'
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь.
+
+        Новые рецепты первыми, страницы листаются курсором `?cursor=`.
+        """
+        user = request.user
+        if user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+
+        def fetch(position, limit):
+            recipe_ids = feed_page(user, position, limit)
+            recipes = self.get_read_queryset().in_bulk(recipe_ids)
+            return [
+                recipes[recipe_id] for recipe_id in recipe_ids
+                if recipe_id in recipes
+            ]
+
+        page = self.paginator.paginate_keyset(fetch, request, self)
+        serializer = RecipeReadSerializer(
+            page, many=True, context=self.get_serializer_context()
         )
-        for ing in ingredients:
-            shopping_list += (
-                f'{ing["ingredient"]}: {ing["quantity"]} {ing["measure"]}\n'
+        return self.paginator.get_paginated_response(serializer.data)
+
+    @action(methods=('get',), detail=False)
+    def cookable(self, request):
+        """Что можно приготовить из имеющихся ингредиентов.
+
+        Ингредиенты передаются параметрами `?ingredients=<id>`.
+        Рецепты ранжирует индекс состава в памяти процесса: сначала
+        те, где не хватает меньше ингредиентов, затем с большей долей
+        имеющихся. В каждом рецепте `matched_ingredients` - сколько
+        ингредиентов есть, `missing_ingredients` - скольких не хватает.
+        """
+        ingredients = request.query_params.getlist('ingredients')
+        if (
+            not ingredients
+            or len(ingredients) > settings.BATCH_MAX_IDS
+            or not all(value.isdecimal() for value in ingredients)
+        ):
+            return Response(
+                {'ingredients': [
+                    'Укажите id имеющихся ингредиентов, '
+                    f'не больше {settings.BATCH_MAX_IDS}.'
+                ]},
+                status=HTTP_400_BAD_REQUEST,
             )
+        recipe_ids, matched, missing = composition_index.rank(
+            map(int, ingredients)
+        )
+        positions = list(self.paginate_queryset(range(len(recipe_ids))))
+        recipes = self.get_read_queryset().in_bulk(
+            recipe_ids[positions].tolist()
+        )
+        page = [
+            (recipes[recipe_id], found, lacking)
+            for recipe_id, found, lacking in zip(
+                recipe_ids[positions].tolist(),
+                matched[positions].tolist(),
+                missing[positions].tolist(),
+            )
+            if recipe_id in recipes
+        ]
+        serializer = RecipeReadSerializer(
+            [recipe for recipe, *_ in page],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        data = [
+            {
+                **item,
+                'matched_ingredients': found,
+                'missing_ingredients': lacking,
+            }
+            for item, (_, found, lacking) in zip(serializer.data, page)
+        ]
+        return self.get_paginated_response(data)
 
-        shopping_list += '\n\nПосчитано в Foodgram'
+    @action(methods=('get',), detail=True)
+    def similar(self, request, pk):
+        """Похожие рецепты по составу ингредиентов.
 
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+        Соседи заранее посчитаны командой `build_similar_recipes`,
+        здесь они только читаются по индексу. `?limit=` ограничивает
+        их число.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        limit = request.query_params.get('limit', '')
+        limit = min(
+            int(limit) if limit.isdecimal() else settings.SIMILAR_RECIPES,
+            settings.SIMILAR_RECIPES,
         )
+        recipes = Recipe.objects.filter(
+            similar_to__recipe=recipe
+        ).order_by('-similar_to__score')[:limit]
+        serializer = ShortRecipeSerializer(
+            recipes, many=True, context={'request': request}
+        )
+        return Response(serializer.data)
+
+    @action(
+        methods=('post', 'delete',), detail=False, url_path='favorite/batch'
+    )
+    def favorite_batch(self, request):
+        """Добавляет/удаляет несколько рецептов в `избранном`."""
+        return self.add_del_batch('favorite')
+
+    @action(
+        methods=('post', 'delete',),
+        detail=False,
+        url_path='shopping_cart/batch',
+    )
+    def shopping_cart_batch(self, request):
+        """Добавляет/удаляет несколько рецептов в `списке покупок`."""
+        return self.add_del_batch('shopping_cart')
+
+    @action(
+        methods=('get',),
+        detail=False,
+        renderer_classes=(TextRenderer, CSVRenderer, JSONRenderer),
+    )
+    def download_shopping_cart(self, request):
+        """Загружает файл со списком покупок.
+
+        Формат выбирается параметром `?format=txt|csv|json`,
+        файл отдаётся потоком по мере чтения из базы.
+        """
+        user = self.request.user
+        if user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        if not user.carts.exists():
+            return Response(status=HTTP_400_BAD_REQUEST)
+        file_format = request.accepted_renderer.format
+        content, content_type = export_shopping_list(user, file_format)
+        filename = f'{user.username}_shopping_list.{file_format}'
+        response = StreamingHttpResponse(content, content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
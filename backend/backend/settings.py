@@ -109,7 +109,63 @@ DATABASES = {
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Тестовая база SQLite в файле: в памяти запросы из разных потоков
+    # не ждут блокировок и тесты одновременной записи пропускаются.
+    DATABASES['default']['TEST'] = {
+        'NAME': os.getenv(
+            'DB_TEST_NAME', default=str(BASE_DIR / 'test_db.sqlite3')
+        ),
+    }
+
+# Версии кэша и счётчики должны быть общими для всех процессов
+# (воркеры gunicorn, команды manage.py). LocMem годится только для
+# разработки и тестов, docker-compose подключает Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+# Время жизни закэшированного количества объектов для пагинации, с.
+COUNT_CACHE_TIMEOUT = int(os.getenv('COUNT_CACHE_TIMEOUT', default=60))
+# Начиная с этого размера таблицы без фильтров считаются по оценке.
+COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('COUNT_ESTIMATE_THRESHOLD', default=100000)
+)
+
+# Сколько секунд клиенты могут не перепроверять справочники.
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', default=600))
+
+# Кэш ответов анонимным пользователям: время жизни, время жизни
+# блокировки на сборку ответа и ожидание чужой сборки (шаги по N с).
+RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_TIMEOUT', default=300)
+)
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+RESPONSE_CACHE_WAIT_STEPS = 40
+RESPONSE_CACHE_WAIT_STEP = 0.05
+
+# Наибольшее число id в одном пакетном запросе
+# к избранному, списку покупок и подпискам.
+BATCH_MAX_IDS = int(os.getenv('BATCH_MAX_IDS', default=100))
+
+# Время жизни общей для всех пользователей части рецепта в кэше, с.
+RECIPE_FRAGMENT_TIMEOUT = int(
+    os.getenv('RECIPE_FRAGMENT_TIMEOUT', default=3600)
+)
+
 AUTH_USER_MODEL = 'users.MyUser'
+
+# Автодополнение ингредиентов из индекса в памяти процесса.
+# Если выключено, поиск идёт по индексам PostgreSQL.
+INGREDIENT_SEARCH_INDEX = (
+    os.getenv('INGREDIENT_SEARCH_INDEX', default='True') == 'True'
+)
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -150,3 +206,30 @@ STATIC_ROOT = BASE_DIR / STATIC_URL
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / MEDIA_URL
+
+# Процессы для подготовки уменьшенных копий картинок рецептов.
+# При 0 копии готовятся сразу после сохранения рецепта.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+
+# Сколько похожих рецептов хранится для каждого рецепта
+# и процессы для их расчёта командой `build_similar_recipes`.
+SIMILAR_RECIPES = int(os.getenv('SIMILAR_RECIPES', default=10))
+SIMILAR_WORKERS = int(os.getenv('SIMILAR_WORKERS', default=2))
+
+# Лента подписок: рецепты авторов, у которых подписчиков не больше
+# FEED_FANOUT_LIMIT, записываются в ленты подписчиков при публикации,
+# остальные добавляются при чтении. Лента хранит FEED_TIMELINE_SIZE
+# последних рецептов.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=1000))
+FEED_TIMELINE_SIZE = int(os.getenv('FEED_TIMELINE_SIZE', default=500))
+FEED_PULLED_AUTHORS_TIMEOUT = 300
+
+# Ограничения на картинку рецепта: размер файла, число пикселей
+# и объём, после которого декодированный файл пишется на диск.
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.getenv('IMAGE_UPLOAD_MAX_BYTES', default=10 * 2 ** 20)
+)
+IMAGE_UPLOAD_MAX_PIXELS = int(
+    os.getenv('IMAGE_UPLOAD_MAX_PIXELS', default=40 * 10 ** 6)
+)
+IMAGE_UPLOAD_SPOOL_SIZE = 2 ** 20
@@ -1,7 +1,12 @@
 from django.contrib.admin import ModelAdmin, TabularInline, register, site
+from django.contrib.auth import get_user_model
 from django.utils.safestring import mark_safe
 
+from .counters import change_counter
 from .models import AmountIngredient, Ingredient, Recipe, Tag
+from .signals import batch_touches
+
+User = get_user_model()
 
 site.site_header = 'Админка Foodgram'
 
@@ -35,7 +40,7 @@ class IngredientAdmin(ModelAdmin):
 @register(Recipe)
 class RecipeAdmin(ModelAdmin):
     list_display = (
-        'name', 'author', 'get_image',
+        'name', 'author', 'get_image', 'favorites_count', 'in_carts_count',
     )
     fields = (
         ('name', 'cooking_time',),
@@ -54,6 +59,20 @@ class RecipeAdmin(ModelAdmin):
     save_on_top = True
     empty_value_display = 'Значение не указано'
 
+    def save_model(self, request, obj, form, change):
+        """Переносит рецепт в счётчик рецептов нового автора."""
+        super().save_model(request, obj, form, change)
+        if change and 'author' in form.changed_data:
+            change_counter(
+                User, 'recipes_count', (form.initial['author'],), -1
+            )
+            change_counter(User, 'recipes_count', (obj.author_id,), 1)
+
+    def save_related(self, request, form, formsets, change):
+        """Переносит изменения ингредиентов в списки покупок одним разом."""
+        with batch_touches():
+            super().save_related(request, form, formsets, change)
+
     def get_image(self, obj):
         return mark_safe(f'<img src={obj.image.url} width="80" height="30"')
 
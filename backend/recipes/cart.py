@@ -0,0 +1,144 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import AmountIngredient, CartIngredient, Recipe
+
+BATCH_SIZE = 1000
+
+
+def recipe_amounts(recipe_ids):
+    """Количество каждого ингредиента в переданных рецептах."""
+    amounts = defaultdict(int)
+    rows = AmountIngredient.objects.filter(
+        recipe__in=recipe_ids
+    ).values_list('ingredients', 'amount')
+    for ingredient_id, amount in rows:
+        amounts[ingredient_id] += amount
+    return amounts
+
+
+def cart_users(recipe):
+    """id пользователей, у которых рецепт в списке покупок."""
+    return list(
+        Recipe.cart.through.objects.filter(
+            recipe=recipe
+        ).values_list('myuser', flat=True)
+    )
+
+
+@transaction.atomic
+def change_cart_totals(user_ids, amounts):
+    """Прибавляет `amounts` к спискам покупок пользователей.
+
+    `amounts` - словарь {id ингредиента: изменение количества}.
+    Количества меняются через `F()`, ингредиенты с нулевым
+    остатком удаляются из списка.
+    """
+    amounts = {key: value for key, value in amounts.items() if value}
+    if not user_ids or not amounts:
+        return
+    CartIngredient.objects.bulk_create(
+        (
+            CartIngredient(user_id=user_id, ingredient_id=ingredient_id)
+            for user_id in user_ids
+            for ingredient_id, amount in amounts.items()
+            if amount > 0
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    by_amount = defaultdict(list)
+    for ingredient_id, amount in amounts.items():
+        by_amount[amount].append(ingredient_id)
+    for amount, ingredient_ids in by_amount.items():
+        CartIngredient.objects.filter(
+            user__in=user_ids, ingredient__in=ingredient_ids
+        ).update(total_amount=F('total_amount') + amount)
+    decreased = [key for key, value in amounts.items() if value < 0]
+    if decreased:
+        CartIngredient.objects.filter(
+            user__in=user_ids,
+            ingredient__in=decreased,
+            total_amount__lte=0,
+        ).delete()
+
+
+def add_to_cart_totals(user, recipe):
+    """Учитывает рецепт, добавленный в список покупок."""
+    change_cart_totals([user.id], recipe_amounts([recipe.id]))
+
+
+def remove_from_cart_totals(user, recipe):
+    """Учитывает рецепт, удалённый из списка покупок."""
+    amounts = recipe_amounts([recipe.id])
+    change_cart_totals(
+        [user.id], {key: -value for key, value in amounts.items()}
+    )
+
+
+def add_recipes_to_cart_totals(user, recipe_ids):
+    """Учитывает несколько рецептов, добавленных в список покупок."""
+    change_cart_totals([user.id], recipe_amounts(recipe_ids))
+
+
+def remove_recipes_from_cart_totals(user, recipe_ids):
+    """Учитывает несколько рецептов, удалённых из списка покупок."""
+    amounts = recipe_amounts(recipe_ids)
+    change_cart_totals(
+        [user.id], {key: -value for key, value in amounts.items()}
+    )
+
+
+def change_recipe_in_carts(recipe, amounts):
+    """Прибавляет изменение ингредиентов рецепта к спискам покупок.
+
+    `amounts` - словарь {id ингредиента: изменение количества}.
+    """
+    amounts = {key: value for key, value in amounts.items() if value}
+    if amounts:
+        change_cart_totals(cart_users(recipe), amounts)
+
+
+def expected_cart_totals():
+    """Списки покупок, посчитанные заново по рецептам в корзинах."""
+    return AmountIngredient.objects.filter(
+        recipe__cart__isnull=False
+    ).values_list(
+        'recipe__cart', 'ingredients'
+    ).annotate(total=Sum('amount')).order_by()
+
+
+def remove_recipe_from_carts(recipe):
+    """Убирает ингредиенты рецепта из всех списков покупок."""
+    amounts = recipe_amounts([recipe.id])
+    change_cart_totals(
+        cart_users(recipe), {key: -value for key, value in amounts.items()}
+    )
+
+
+@transaction.atomic
+def rebuild_cart_totals(expected=None):
+    """Пересобирает таблицу списков покупок по рецептам в корзинах.
+
+    `expected` - уже посчитанный словарь
+    {(id пользователя, id ингредиента): количество}.
+    """
+    if expected is None:
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in expected_cart_totals()
+        }
+    CartIngredient.objects.all().delete()
+    CartIngredient.objects.bulk_create(
+        (
+            CartIngredient(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total,
+            )
+            for (user_id, ingredient_id), total in expected.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
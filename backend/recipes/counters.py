@@ -0,0 +1,149 @@
+"""Счётчики избранного, списков покупок, рецептов и подписчиков.
+
+Счётчики хранятся в строках `Recipe` и `MyUser`, поэтому сортировка
+и вывод количеств обходятся без агрегации. Меняются они запросом
+`UPDATE ... SET count = count + 1`, и параллельные изменения не
+теряются. API меняет счётчики вместе со связями, изменения через ORM
+и админку учитывают сигналы, а расхождения находит и исправляет
+команда `reconcile_counters`.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Recipe
+
+User = get_user_model()
+
+# Модель и поле счётчика, связанные строки и их столбец
+# со ссылкой на объект счётчика.
+COUNTERS = (
+    (Recipe, 'favorites_count', Recipe.favorites.through, 'recipe'),
+    (Recipe, 'in_carts_count', Recipe.cart.through, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', User.subscribe.through, 'to_myuser'),
+)
+
+# Промежуточная таблица: модель и поле счётчика, столбец объекта
+# счётчика, столбец второго объекта связи и объявлено ли поле
+# `ManyToManyField` на модели счётчика.
+RELATION_COUNTERS = {
+    Recipe.favorites.through: (
+        Recipe, 'favorites_count', 'recipe', 'myuser', True
+    ),
+    Recipe.cart.through: (
+        Recipe, 'in_carts_count', 'recipe', 'myuser', True
+    ),
+    User.subscribe.through: (
+        User, 'subscribers_count', 'to_myuser', 'from_myuser', False
+    ),
+}
+
+
+# Версия счётчика растёт вместе с каждым его изменением. Сумма версий
+# рецептов входит в ETag, поэтому меняются валидаторы только тех
+# ответов, в которых есть изменённые рецепты.
+COUNTER_VERSIONS = {
+    (Recipe, 'favorites_count'): 'favorites_version',
+}
+
+
+def counter_values(model, field, value):
+    """Значения `UPDATE` для счётчика и его версии."""
+    values = {field: value}
+    version = COUNTER_VERSIONS.get((model, field))
+    if version is not None:
+        values[version] = F(version) + 1
+    return values
+
+
+def change_counter(model, field, ids, delta):
+    """Прибавляет `delta` к счётчику объектов `ids`."""
+    return model.objects.filter(id__in=ids).update(
+        **counter_values(model, field, F(field) + delta)
+    )
+
+
+def expected_count(related, column):
+    """Выражение с числом связанных строк для подзапроса по `pk`."""
+    rows = related.objects.filter(
+        **{column: OuterRef('pk')}
+    ).order_by().values(column).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+
+def recount(model, field, related, column, ids=None):
+    """Пересчитывает счётчик объектов `ids`, по умолчанию - всех.
+
+    Меняются только строки с расхождением, возвращается их число.
+    """
+    objects = model.objects.exclude(
+        **{field: expected_count(related, column)}
+    )
+    if ids is not None:
+        objects = objects.filter(id__in=ids)
+    return objects.update(
+        **counter_values(model, field, expected_count(related, column))
+    )
+
+
+def recount_counters():
+    """Пересчитывает все счётчики."""
+    for counter in COUNTERS:
+        recount(*counter)
+
+
+def counter_drift():
+    """Расхождения счётчиков с данными.
+
+    Возвращает строки `(модель, поле, id, значение, верное значение)`.
+    """
+    for model, field, related, column in COUNTERS:
+        rows = model.objects.annotate(
+            expected=expected_count(related, column)
+        ).exclude(**{field: F('expected')}).order_by('id').values_list(
+            'id', field, 'expected'
+        )
+        for object_id, actual, correct in rows.iterator():
+            yield model, field, object_id, actual, correct
+
+
+def relation_changed(through, instance, action, reverse, pk_set):
+    """Пересчитывает счётчики после изменения связи через ORM.
+
+    `add()` и `remove()` не сообщают, какие строки действительно
+    изменились, поэтому счётчики затронутых объектов пересчитываются
+    целиком. Для `clear()` со стороны второго объекта id запоминаются
+    до удаления строк.
+    """
+    model, field, column, other, declared = RELATION_COUNTERS[through]
+    if reverse != declared:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            recount(model, field, through, column, (instance.pk,))
+        return
+    if action == 'pre_clear':
+        instance._cleared_counter_ids = set(through.objects.filter(
+            **{other: instance.pk}
+        ).values_list(f'{column}_id', flat=True))
+    elif action == 'post_clear':
+        ids = instance.__dict__.pop('_cleared_counter_ids', ())
+        if ids:
+            recount(model, field, through, column, ids)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        recount(model, field, through, column, pk_set)
+
+
+def forget_user(user):
+    """Уменьшает счётчики объектов, связанных с удаляемым пользователем.
+
+    Строки связей удаляются каскадом без сигналов `m2m_changed`.
+    """
+    for through, (model, field, column, other, _) in (
+        RELATION_COUNTERS.items()
+    ):
+        change_counter(
+            model,
+            field,
+            through.objects.filter(**{other: user.pk}).values(column),
+            -1,
+        )
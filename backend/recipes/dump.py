@@ -0,0 +1,124 @@
+"""Таблицы для выгрузки `export_data` и загрузки `import_data`.
+
+Таблицы перечислены в порядке загрузки: сначала справочники
+и пользователи, затем рецепты и связи.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from .models import AmountIngredient, Ingredient, Recipe, Tag
+from .utils import normalize_name
+
+User = get_user_model()
+
+
+class Table:
+    """Таблица выгрузки.
+
+    `columns` - столбцы файла (`attname` полей модели), `key` - столбцы
+    естественного ключа для повторной загрузки файла без `id`,
+    `update` - столбцы, которые при повторной загрузке обновляются.
+    `keep` - столбцы, которые не перезаписываются никогда.
+    `prepare` дополняет строку вычисляемыми полями, `user_column` -
+    столбец с пользователем, чьи связи меняет таблица.
+    """
+    def __init__(self, name, model, columns, key, update=(), keep=(),
+                 prepare=None, user_column=None):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.key = key
+        self.update = update
+        self.keep = keep
+        self.prepare = prepare
+        self.user_column = user_column
+
+    def field(self, column):
+        """Поле модели по имени столбца."""
+        for field in self.model._meta.concrete_fields:
+            if column in (field.name, field.attname):
+                return field
+        raise KeyError(column)
+
+
+def prepare_search_name(row):
+    row['search_name'] = normalize_name(row['name'])
+
+
+def prepare_user(row):
+    row.setdefault('password', make_password(None))
+
+
+def prepare_recipe(row):
+    prepare_search_name(row)
+    row.setdefault('pub_date', timezone.now())
+    row['updated_at'] = timezone.now()
+
+
+TABLES = (
+    Table(
+        'tags', Tag,
+        columns=('id', 'name', 'color', 'slug'),
+        key=('slug',),
+        update=('name', 'color'),
+    ),
+    Table(
+        'ingredients', Ingredient,
+        columns=('id', 'name', 'measurement_unit'),
+        key=('name', 'measurement_unit'),
+        prepare=prepare_search_name,
+    ),
+    Table(
+        'users', User,
+        columns=(
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'is_active', 'date_joined',
+        ),
+        key=('username',),
+        update=('email', 'first_name', 'last_name', 'is_active'),
+        keep=('password',),
+        prepare=prepare_user,
+    ),
+    Table(
+        'recipes', Recipe,
+        columns=(
+            'id', 'author_id', 'name', 'text', 'cooking_time', 'image',
+            'pub_date',
+        ),
+        key=('name', 'author_id'),
+        update=('text', 'cooking_time', 'image', 'updated_at'),
+        prepare=prepare_recipe,
+    ),
+    Table(
+        'recipe_tags', Recipe.tags.through,
+        columns=('recipe_id', 'tag_id'),
+        key=('recipe_id', 'tag_id'),
+    ),
+    Table(
+        'amounts', AmountIngredient,
+        columns=('recipe_id', 'ingredients_id', 'amount'),
+        key=('recipe_id', 'ingredients_id'),
+        update=('amount',),
+    ),
+    Table(
+        'favorites', Recipe.favorites.through,
+        columns=('myuser_id', 'recipe_id'),
+        key=('myuser_id', 'recipe_id'),
+        user_column='myuser_id',
+    ),
+    Table(
+        'carts', Recipe.cart.through,
+        columns=('myuser_id', 'recipe_id'),
+        key=('myuser_id', 'recipe_id'),
+        user_column='myuser_id',
+    ),
+    Table(
+        'subscriptions', User.subscribe.through,
+        columns=('from_myuser_id', 'to_myuser_id'),
+        key=('from_myuser_id', 'to_myuser_id'),
+        user_column='from_myuser_id',
+    ),
+)
+
+TABLES_BY_NAME = {table.name: table for table in TABLES}
@@ -0,0 +1,250 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Новый рецепт автора, у которого не больше `FEED_FANOUT_LIMIT`
+подписчиков, сразу записывается в ленты подписчиков (`TimelineEntry`).
+Рецепты популярных авторов в ленты не пишутся, они выбираются при
+чтении и сливаются с записанной лентой. Лента пользователя хранит
+около `FEED_TIMELINE_SIZE` последних рецептов, более старые страницы
+выбираются из рецептов напрямую. Когда автор перестаёт быть
+популярным, его последние рецепты возвращаются в ленты подписчиков.
+"""
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import PulledAuthor, Recipe, TimelineEntry
+
+User = get_user_model()
+Subscription = User.subscribe.through
+
+PULLED_AUTHORS_KEY = 'feed:pulled-authors'
+BATCH_SIZE = 500
+
+
+def chunked(values, size=BATCH_SIZE):
+    values = iter(values)
+    while True:
+        chunk = list(islice(values, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def pulled_authors():
+    """Авторы, чьи рецепты добавляются в ленты при чтении.
+
+    Список кэшируется на `FEED_PULLED_AUTHORS_TIMEOUT` секунд.
+    """
+    authors = cache.get(PULLED_AUTHORS_KEY)
+    if authors is None:
+        authors = update_pulled_authors()
+        cache.set(
+            PULLED_AUTHORS_KEY, authors, settings.FEED_PULLED_AUTHORS_TIMEOUT
+        )
+    return authors
+
+
+def update_pulled_authors():
+    """Пересчитывает популярных авторов и сохраняет их в `PulledAuthor`.
+
+    Рецепты популярного автора не пишутся в ленты, а его новым
+    подписчикам ленты не дополняются. Поэтому подписчикам автора,
+    который перестал быть популярным, в ленты добавляются его
+    последние рецепты, иначе опубликованные за это время рецепты
+    пропали бы из лент.
+    """
+    authors = set(Subscription.objects.order_by().values(
+        'to_myuser'
+    ).annotate(
+        total=Count('id')
+    ).filter(
+        total__gt=settings.FEED_FANOUT_LIMIT
+    ).values_list('to_myuser', flat=True))
+    with transaction.atomic():
+        previous = set(PulledAuthor.objects.select_for_update().values_list(
+            'author', flat=True
+        ))
+        left = previous - authors
+        PulledAuthor.objects.filter(author__in=left).delete()
+        PulledAuthor.objects.bulk_create(
+            [PulledAuthor(author_id=author_id)
+             for author_id in authors - previous],
+            ignore_conflicts=True,
+        )
+        for author_id in left:
+            followers = Subscription.objects.filter(
+                to_myuser=author_id
+            ).values_list('from_myuser', flat=True)
+            for user_ids in chunked(followers.iterator()):
+                push_recipes(user_ids, (author_id,))
+    return authors
+
+
+def before(position, date_field='pub_date', id_field='id'):
+    """Условие `(pub_date, id) < position` для порядка по убыванию."""
+    if position is None:
+        return Q()
+    pub_date, object_id = position
+    return Q(**{f'{date_field}__lt': pub_date}) | Q(**{
+        date_field: pub_date, f'{id_field}__lt': object_id
+    })
+
+
+def trim_timelines(user_ids):
+    """Обрезает переполненные ленты до `FEED_TIMELINE_SIZE` рецептов.
+
+    Ленте позволено вырасти на десятую часть, поэтому обрезка
+    нужна не после каждого рецепта.
+    """
+    size = settings.FEED_TIMELINE_SIZE
+    overflowing = TimelineEntry.objects.filter(
+        user__in=user_ids
+    ).order_by().values('user').annotate(
+        total=Count('id')
+    ).filter(total__gt=size + size // 10).values_list('user', flat=True)
+    for user_id in overflowing:
+        entries = TimelineEntry.objects.filter(user=user_id)
+        last = entries.order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id'
+        )[size - 1]
+        entries.filter(before(last, id_field='recipe_id')).delete()
+
+
+def fan_out(recipe):
+    """Записывает новый рецепт в ленты подписчиков автора."""
+    if recipe.author_id in pulled_authors():
+        return
+    followers = Subscription.objects.filter(
+        to_myuser=recipe.author_id
+    ).values_list('from_myuser', flat=True)
+    for user_ids in chunked(followers.iterator()):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    author_id=recipe.author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True,
+        )
+        trim_timelines(user_ids)
+
+
+def push_recipes(user_ids, author_ids):
+    """Добавляет в ленты пользователей последние рецепты авторов."""
+    recipes = list(Recipe.objects.filter(author__in=author_ids).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'author_id', 'pub_date')[
+        :settings.FEED_TIMELINE_SIZE
+    ])
+    if not recipes:
+        return
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in user_ids
+            for recipe_id, author_id, pub_date in recipes
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines(user_ids)
+
+
+def follow_authors(user, author_ids):
+    """Добавляет в ленту последние рецепты новых подписок."""
+    author_ids = set(author_ids) - pulled_authors()
+    if author_ids:
+        push_recipes((user.id,), author_ids)
+
+
+def unfollow_authors(user, author_ids):
+    """Убирает из ленты рецепты авторов, от которых пользователь
+    отписался."""
+    TimelineEntry.objects.filter(user=user, author__in=author_ids).delete()
+
+
+def rebuild_timelines(user_ids=None):
+    """Пересобирает ленты пользователей, по умолчанию - всех."""
+    subscriptions = Subscription.objects.order_by('from_myuser')
+    if user_ids is not None:
+        subscriptions = subscriptions.filter(from_myuser__in=user_ids)
+    TimelineEntry.objects.filter(
+        **({} if user_ids is None else {'user__in': user_ids})
+    ).delete()
+    authors = {}
+    for user_id, author_id in subscriptions.values_list(
+        'from_myuser', 'to_myuser'
+    ).iterator():
+        authors.setdefault(user_id, []).append(author_id)
+    for user_id, author_ids in authors.items():
+        follow_authors(User(id=user_id), author_ids)
+
+
+def feed_page(user, position, limit):
+    """Не больше `limit` рецептов ленты после курсора `position`.
+
+    `position` - пара `(pub_date, id)` последнего показанного рецепта.
+    Записанная лента сливается с рецептами популярных авторов, а если
+    лента кончилась, продолжается выборкой из всех подписок. Рецепты
+    возвращаются id по убыванию `(pub_date, id)`.
+    """
+    if position is not None:
+        position = tuple(position)
+    # Пересчёт популярных авторов может дополнить ленту, поэтому
+    # он идёт до чтения записанной ленты.
+    pulled = pulled_authors()
+    following = Subscription.objects.filter(
+        from_myuser=user
+    ).values('to_myuser')
+    pushed = list(TimelineEntry.objects.filter(
+        before(position, id_field='recipe_id'),
+        user=user,
+        author__in=following,
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[:limit])
+    sources = [pushed]
+
+    if pulled:
+        pulled = set(following.filter(
+            to_myuser__in=pulled
+        ).values_list('to_myuser', flat=True))
+    recipes = Recipe.objects.order_by('-pub_date', '-id').values_list(
+        'pub_date', 'id'
+    )
+    if pulled:
+        sources.append(list(recipes.filter(
+            before(position), author__in=pulled
+        )[:limit]))
+    if len(pushed) < limit:
+        oldest = TimelineEntry.objects.filter(user=user).order_by(
+            'pub_date', 'recipe_id'
+        ).values_list('pub_date', 'recipe_id').first()
+        boundary = min(filter(None, (position, oldest)), default=None)
+        sources.append(list(recipes.filter(
+            before(boundary), author__in=following
+        )[:limit]))
+
+    page = []
+    seen = set()
+    for _, recipe_id in merge(*sources, reverse=True):
+        if recipe_id not in seen:
+            seen.add(recipe_id)
+            page.append(recipe_id)
+            if len(page) == limit:
+                break
+    return page
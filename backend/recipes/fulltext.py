@@ -0,0 +1,118 @@
+"""Полнотекстовый поиск рецептов.
+
+Ищется по названию, ингредиентам и описанию, совпадения в названии
+весят больше. В PostgreSQL поиск идёт по столбцу `search_vector`
+(словари `russian` и `english`) с GIN индексом, в SQLite - по
+таблице FTS5 `recipes_recipe_fts`. Оба создаются миграцией
+`0007_recipe_search_ingredients` и обновляются самой базой при
+изменении рецепта. Для остальных баз остаётся поиск по вхождению.
+"""
+import re
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import AmountIngredient, Recipe
+from .utils import normalize_name
+
+FTS_TABLE = 'recipes_recipe_fts'
+SEARCH_CONFIGS = ('russian', 'english')
+MAX_TERMS = 10
+
+
+def search_ingredients(recipe_ids):
+    """Названия ингредиентов рецептов одной строкой для поиска."""
+    names = defaultdict(list)
+    rows = AmountIngredient.objects.filter(
+        recipe__in=recipe_ids
+    ).order_by('id').values_list('recipe_id', 'ingredients__search_name')
+    for recipe_id, name in rows:
+        names[recipe_id].append(name)
+    return {recipe_id: ' '.join(names[recipe_id]) for recipe_id in recipe_ids}
+
+
+def search_terms(query):
+    """Слова запроса без знаков операторов поиска."""
+    return re.findall(r'\w+', normalize_name(query))[:MAX_TERMS]
+
+
+def postgresql_search(queryset, terms):
+    query = ' & '.join(f'{term}:*' for term in terms)
+    tsquery = ' || '.join(
+        f"to_tsquery('{config}', %s)" for config in SEARCH_CONFIGS
+    )
+    params = (query,) * len(SEARCH_CONFIGS)
+    return queryset.annotate(
+        search_match=RawSQL(
+            f'"recipes_recipe"."search_vector" @@ ({tsquery})',
+            params,
+            output_field=BooleanField(),
+        ),
+        search_rank=RawSQL(
+            f'ts_rank("recipes_recipe"."search_vector", {tsquery})',
+            params,
+            output_field=FloatField(),
+        ),
+    ).filter(search_match=True)
+
+
+def sqlite_search(queryset, terms):
+    query = ' '.join(f'"{term}"*' for term in terms)
+    return queryset.filter(
+        id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (query,),
+        )
+    ).annotate(
+        search_rank=RawSQL(
+            f'(SELECT -bm25({FTS_TABLE}, 10.0, 5.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = "recipes_recipe"."id")',
+            (query,),
+            output_field=FloatField(),
+        ),
+    )
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, лучшие совпадения первыми.
+
+    Все слова запроса должны найтись, каждое ищется как начало слова.
+    Оценка совпадения - в `search_rank`, при равной оценке выше
+    новые рецепты.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    vendor = connections[router.db_for_read(Recipe)].vendor
+    if vendor == 'postgresql':
+        queryset = postgresql_search(queryset, terms)
+    elif vendor == 'sqlite':
+        queryset = sqlite_search(queryset, terms)
+    else:
+        for term in terms:
+            queryset = queryset.filter(
+                Q(search_name__contains=term)
+                | Q(search_ingredients__contains=term)
+                | Q(text__icontains=term)
+            )
+        queryset = queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
+
+
+def rebuild_search_ingredients(batch_size=1000):
+    """Пересобирает ингредиенты для поиска у всех рецептов."""
+    recipe_ids = list(Recipe.objects.order_by('id').values_list(
+        'id', flat=True
+    ))
+    for start in range(0, len(recipe_ids), batch_size):
+        texts = search_ingredients(recipe_ids[start:start + batch_size])
+        Recipe.objects.bulk_update(
+            [Recipe(id=recipe_id, search_ingredients=text)
+             for recipe_id, text in texts.items()],
+            ('search_ingredients',),
+        )
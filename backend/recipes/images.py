@@ -0,0 +1,120 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+
+from .models import Recipe
+from .thumbnails import render_variants
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipe_images/variants/'
+
+
+class ImagePipeline:
+    """Фоновая подготовка уменьшенных копий картинок рецептов.
+
+    Перекодирование выполняется в пуле процессов и не задерживает
+    запрос. Готовые файлы сохраняет и записывает в `image_variants`
+    основной процесс. Пока копий нет, клиенты получают оригинал.
+    При `IMAGE_WORKERS = 0` копии готовятся сразу, в том же потоке.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.executor = None
+
+    def get_executor(self, broken=None):
+        """Пул процессов. Сломанный пул `broken` заменяется новым."""
+        with self.lock:
+            if self.executor is None or self.executor is broken:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                )
+            return self.executor
+
+    def schedule(self, recipe):
+        """Ставит картинку рецепта в очередь после фиксации транзакции."""
+        recipe_id, name = recipe.id, recipe.image.name
+        transaction.on_commit(lambda: self.submit(recipe_id, name))
+
+    def submit(self, recipe_id, name):
+        try:
+            with default_storage.open(name) as file:
+                data = file.read()
+        except OSError:
+            logger.exception('Не удалось прочитать картинку %s', name)
+            return
+        if not settings.IMAGE_WORKERS:
+            try:
+                self.store(recipe_id, name, render_variants(data))
+            except Exception:
+                logger.exception('Не удалось подготовить копии %s', name)
+            return
+        executor = self.get_executor()
+        try:
+            future = executor.submit(render_variants, data)
+        except BrokenProcessPool:
+            future = self.get_executor(executor).submit(render_variants, data)
+        future.add_done_callback(
+            lambda future: self.done(recipe_id, name, future)
+        )
+
+    def done(self, recipe_id, name, future):
+        """Сохраняет результат. Выполняется в служебном потоке пула."""
+        try:
+            self.store(recipe_id, name, future.result())
+        except Exception:
+            logger.exception('Не удалось подготовить копии %s', name)
+        finally:
+            connections.close_all()
+
+    def store(self, recipe_id, name, rendered):
+        """Сохраняет файлы копий и записывает их в рецепт.
+
+        Если картинку рецепта успели заменить, копии не нужны.
+        """
+        recipe = Recipe.objects.filter(id=recipe_id, image=name).first()
+        if recipe is None:
+            return
+        stem = os.path.splitext(os.path.basename(name))[0]
+        variants = {'source': name}
+        for variant, files in rendered.items():
+            variants[variant] = {
+                extension: default_storage.save(
+                    f'{VARIANTS_DIR}{stem}_{variant}.{extension}',
+                    ContentFile(content),
+                )
+                for extension, content in files.items()
+            }
+        old_files = variant_files(recipe.image_variants)
+        recipe.image_variants = variants
+        recipe.save(update_fields=('image_variants', 'updated_at'))
+        for old_file in old_files:
+            default_storage.delete(old_file)
+
+
+def variant_files(variants):
+    """Имена всех файлов копий."""
+    return [
+        file
+        for variant, files in variants.items() if variant != 'source'
+        for file in files.values()
+    ]
+
+
+def needs_variants(recipe):
+    """Картинка рецепта новая и копий для неё ещё нет."""
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name
+    )
+
+
+image_pipeline = ImagePipeline()
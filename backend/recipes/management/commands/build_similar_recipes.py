@@ -0,0 +1,52 @@
+from time import monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import BLOCK_SIZE, build_similar, update_similar
+
+
+class Command(BaseCommand):
+    help = ('Расчёт похожих рецептов по составу ингредиентов. '
+            'С --incremental считаются только новые и изменённые '
+            'после прошлого расчёта рецепты, а также рецепты, '
+            'у которых был удалён один из соседей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=('Досчитать только новые и изменённые рецепты '
+                  'и рецепты с удалёнными соседями'),
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.SIMILAR_WORKERS,
+            help=('Процессы для полного расчёта, в том числе при досчёте '
+                  'большей части рецептов'),
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=BLOCK_SIZE,
+            help='Сколько рецептов считать в одном блоке',
+        )
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        k = settings.SIMILAR_RECIPES
+        if options['incremental']:
+            total = update_similar(
+                k, workers=max(options['workers'], 1),
+                block_size=options['block_size'],
+            )
+            message = f'Пересчитано рецептов: {total}'
+        else:
+            total = build_similar(
+                k, max(options['workers'], 1), options['block_size']
+            )
+            message = f'Сохранено пар похожих рецептов: {total}'
+        self.stdout.write(self.style.SUCCESS(
+            f'{message} за {monotonic() - started:.2f} с'
+        ))
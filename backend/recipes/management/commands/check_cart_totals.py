@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from recipes.cart import expected_cart_totals, rebuild_cart_totals
+from recipes.models import CartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Сверка списков покупок с рецептами в корзинах'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Пересобрать таблицу, если найдены расхождения',
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in expected_cart_totals()
+        }
+        live = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in CartIngredient.objects.values_list(
+                'user', 'ingredient', 'total_amount'
+            )
+        }
+        differences = sorted(
+            (key, live.get(key), expected.get(key))
+            for key in set(expected) | set(live)
+            if live.get(key) != expected.get(key)
+        )
+        for (user_id, ingredient_id), actual, correct in differences:
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'{actual} вместо {correct}'
+            )
+        if not differences:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        if not options['fix']:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {len(differences)}'
+            ))
+            return
+        rebuild_cart_totals(expected)
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, исправлено: {len(differences)}'
+        ))
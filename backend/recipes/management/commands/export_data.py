@@ -0,0 +1,106 @@
+import csv
+import json
+from datetime import date, datetime
+from pathlib import Path
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from recipes.dump import TABLES, TABLES_BY_NAME
+from .import_data import open_text
+
+CHUNK_SIZE = 2000
+
+
+def json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    return json_value(value) if isinstance(value, (date, datetime)) else value
+
+
+class Command(BaseCommand):
+    help = ('Выгрузка рецептов, справочников, пользователей и связей '
+            'в csv или jsonl для загрузки обратно через import_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Папка для файлов выгрузки')
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'jsonl'),
+            default='csv',
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Сжимать файлы',
+        )
+        parser.add_argument(
+            '--tables',
+            nargs='+',
+            choices=TABLES_BY_NAME,
+            help='Выгрузить только эти таблицы',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько строк читать из базы за один раз',
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options['directory'])
+        directory.mkdir(parents=True, exist_ok=True)
+        names = options['tables'] or TABLES_BY_NAME
+        suffix = '.gz' if options['gzip'] else ''
+        for table in TABLES:
+            if table.name not in names:
+                continue
+            path = directory / f'{table.name}.{options["format"]}{suffix}'
+            started = monotonic()
+            with open_text(path, 'wt') as file:
+                total = self.write(
+                    file, table, options['format'], options['chunk_size']
+                )
+            seconds = monotonic() - started
+            if options['verbosity']:
+                self.stdout.write(
+                    f'{table.name}: {total} строк в {path.name} '
+                    f'за {seconds:.2f} с '
+                    f'({total / max(seconds, 1e-6):.0f} строк/с)'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные выгружены в {directory}'
+        ))
+
+    def write(self, file, table, file_format, chunk_size):
+        """Пишет таблицу построчно, читая базу пачками.
+
+        `iterator()` в PostgreSQL читает через серверный курсор,
+        поэтому память не растёт с размером таблицы.
+        """
+        rows = table.model.objects.order_by('pk').values_list(
+            *table.columns
+        ).iterator(chunk_size=chunk_size)
+        total = 0
+        if file_format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(table.columns)
+            for row in rows:
+                writer.writerow([csv_value(value) for value in row])
+                total += 1
+            return total
+        for row in rows:
+            file.write(json.dumps(
+                dict(zip(table.columns, row)),
+                ensure_ascii=False,
+                default=json_value,
+            ))
+            file.write('\n')
+            total += 1
+        return total
@@ -1,23 +1,372 @@
 import csv
+import gzip
+import json
+from io import StringIO
+from pathlib import Path
+from time import monotonic
+
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.db.models import CharField, TextField
+
+from recipes.cart import rebuild_cart_totals
+from recipes.counters import recount_counters
+from recipes.dump import TABLES, TABLES_BY_NAME
+from recipes.fulltext import rebuild_search_ingredients
+from recipes.signals import data_imported
+
+DEFAULT_DIR = Path(settings.BASE_DIR) / 'static' / 'data'
+FORMATS = ('csv', 'json', 'jsonl')
+CHUNK_SIZE = 5000
+
+
+def open_text(path, mode='rt'):
+    """Открывает текстовый файл, `.gz` - через gzip."""
+    if path.suffix == '.gz':
+        return gzip.open(path, mode, encoding='UTF-8', newline='')
+    return open(path, mode, encoding='UTF-8', newline='')
+
+
+def split_name(path):
+    """Имя таблицы и формат по имени файла `tags.csv.gz`."""
+    name, *suffixes = path.name.split('.')
+    suffixes = [suffix for suffix in suffixes if suffix != 'gz']
+    return name, suffixes[-1] if suffixes else None
+
+
+def read_rows(file, file_format):
+    """Строки файла как словари."""
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    elif file_format == 'jsonl':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from json.load(file)
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def copy_value(value):
+    """Значение в текстовом формате `COPY`."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+class Loader:
+    """Загрузка строк одной таблицы пачками.
+
+    Строки вставляются через `INSERT ... ON CONFLICT`: если в файле
+    есть `id`, существующие строки с тем же `id` обновляются, иначе
+    строки сопоставляются по естественному ключу таблицы. Поэтому
+    файл можно загружать повторно. В PostgreSQL пачка сначала
+    передаётся через `COPY` во временную таблицу.
+    """
+    def __init__(self, table, use_copy):
+        self.table = table
+        self.model = table.model
+        self.connection = connections[router.db_for_write(self.model)]
+        self.vendor = self.connection.vendor
+        self.use_copy = use_copy and self.vendor == 'postgresql'
+        self.columns = None
+        self.user_ids = set()
 
-from recipes.models import Ingredient
+    def convert(self, raw):
+        """Строка файла со значениями полей модели."""
+        row = {}
+        for column, value in raw.items():
+            if column not in self.table.columns:
+                raise CommandError(
+                    f'{self.table.name}: неизвестный столбец {column}'
+                )
+            field = self.table.field(column)
+            if value == '' and (
+                field.null or not isinstance(field, (CharField, TextField))
+            ):
+                value = None
+            row[field.attname] = field.to_python(value)
+        if self.table.prepare:
+            self.table.prepare(row)
+        if self.table.user_column:
+            self.user_ids.add(row[self.table.user_column])
+        return row
 
-TABLES_DICT = {
-    Ingredient: 'ingredients.csv'}
+    def set_columns(self, row):
+        """Столбцы вставки по первой строке и значения по умолчанию."""
+        self.defaults = {}
+        for field in self.model._meta.concrete_fields:
+            if field.primary_key or field.attname in row:
+                continue
+            if field.has_default() or field.null:
+                self.defaults[field.attname] = field
+        self.columns = [*row, *self.defaults]
+        self.fields = [self.table.field(column) for column in self.columns]
+        if 'id' in row:
+            self.key = ('id',)
+            self.update = [
+                column for column in row
+                if column != 'id' and column not in self.table.keep
+            ]
+        else:
+            self.key = self.table.key
+            self.update = [
+                column for column in self.columns
+                if column in self.table.update
+            ]
+
+    def values(self, row):
+        for column, field in zip(self.columns, self.fields):
+            if column in self.defaults:
+                value = field.get_default()
+            else:
+                value = row[column]
+            yield field.get_db_prep_save(value, self.connection)
+
+    def conflict_sql(self):
+        quote = self.connection.ops.quote_name
+        action = 'DO NOTHING'
+        if self.update:
+            action = 'DO UPDATE SET ' + ', '.join(
+                f'{quote(column)} = EXCLUDED.{quote(column)}'
+                for column in self.update
+            )
+        target = ', '.join(quote(column) for column in self.key)
+        return f'ON CONFLICT ({target}) {action}'
+
+    def batch_size(self, chunk_size):
+        max_params = self.connection.features.max_query_params
+        if not max_params:
+            return chunk_size
+        return max(1, min(chunk_size, max_params // len(self.columns)))
+
+    def load(self, rows, chunk_size, report):
+        """Загружает строки, возвращает их количество."""
+        total = 0
+        for chunk in chunked(rows, chunk_size):
+            chunk = [self.convert(raw) for raw in chunk]
+            if self.columns is None:
+                self.set_columns(chunk[0])
+                if self.use_copy:
+                    self.create_temp_table()
+            total += len(chunk)
+            chunk = self.unique(chunk)
+            if self.use_copy:
+                self.copy(chunk)
+            elif self.vendor in ('postgresql', 'sqlite'):
+                for batch in chunked(chunk, self.batch_size(chunk_size)):
+                    self.upsert(batch)
+            else:
+                self.model.objects.bulk_create(
+                    (self.model(**row) for row in chunk),
+                    batch_size=chunk_size,
+                    ignore_conflicts=True,
+                )
+            report(total)
+        return total
+
+    def unique(self, rows):
+        """Оставляет последнюю из строк с одинаковым ключом:
+        одна вставка не может изменить строку дважды."""
+        return list({
+            tuple(row[column] for column in self.key): row for row in rows
+        }.values())
+
+    def upsert(self, rows):
+        quote = self.connection.ops.quote_name
+        placeholders = '({})'.format(', '.join(['%s'] * len(self.columns)))
+        sql = 'INSERT INTO {} ({}) VALUES {} {}'.format(
+            quote(self.model._meta.db_table),
+            ', '.join(quote(column) for column in self.columns),
+            ', '.join([placeholders] * len(rows)),
+            self.conflict_sql(),
+        )
+        params = [value for row in rows for value in self.values(row)]
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @property
+    def temp_table(self):
+        return self.connection.ops.quote_name(
+            f'import_{self.model._meta.db_table}'
+        )
+
+    def create_temp_table(self):
+        quote = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE {self.temp_table} '
+                f'(LIKE {quote(self.model._meta.db_table)} '
+                'INCLUDING DEFAULTS) ON COMMIT DROP'
+            )
+
+    def copy(self, rows):
+        """`COPY` пачки во временную таблицу и перенос в основную."""
+        quote = self.connection.ops.quote_name
+        columns = ', '.join(quote(column) for column in self.columns)
+        buffer = StringIO()
+        for row in rows:
+            buffer.write(
+                '\t'.join(copy_value(value) for value in self.values(row))
+            )
+            buffer.write('\n')
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {self.temp_table} ({columns}) FROM STDIN', buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {quote(self.model._meta.db_table)} '
+                f'({columns}) SELECT {columns} FROM {self.temp_table} '
+                f'{self.conflict_sql()}'
+            )
+            cursor.execute(f'TRUNCATE {self.temp_table}')
 
 
 class Command(BaseCommand):
-    help = 'Загрузка данных из csv файлов'
-
-    def handle(self, *args, **kwargs):
-        for model, base in TABLES_DICT.items():
-            with open(
-                f'{settings.BASE_DIR}/static/data/{base}',
-                'r', encoding='UTF-8'
-            ) as csv_file:
-                reader = csv.DictReader(csv_file)
-                model.objects.bulk_create(model(**data) for data in reader)
-
-        self.stdout.write(self.style.SUCCESS('Данные успешно загружены'))
+    help = ('Загрузка данных из csv, json и jsonl файлов. '
+            'Повторная загрузка тех же файлов ничего не дублирует.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            help=('Файлы или папки с файлами вида <таблица>.<формат>[.gz]. '
+                  f'По умолчанию {DEFAULT_DIR}. '
+                  f'Таблицы: {", ".join(TABLES_BY_NAME)}.'),
+        )
+        parser.add_argument(
+            '--table',
+            choices=TABLES_BY_NAME,
+            help='Таблица для файлов, названных не по имени таблицы',
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файлов, если его нельзя понять по расширению',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько строк загружать за один раз',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Прочитать и загрузить данные, затем отменить изменения',
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY в PostgreSQL',
+        )
+
+    def find_files(self, options):
+        """Пары (таблица, файл, формат) в порядке загрузки таблиц."""
+        found = []
+        for path in map(Path, options['paths'] or (DEFAULT_DIR,)):
+            if path.is_dir():
+                files = [
+                    file for file in sorted(path.iterdir())
+                    if split_name(file)[1] in FORMATS
+                    and split_name(file)[0] in TABLES_BY_NAME
+                ]
+            elif path.is_file():
+                files = [path]
+            else:
+                raise CommandError(f'Файл {path} не найден')
+            for file in files:
+                name, file_format = split_name(file)
+                name = options['table'] or name
+                file_format = options['format'] or file_format
+                if name not in TABLES_BY_NAME:
+                    raise CommandError(
+                        f'{file}: неизвестная таблица {name}, '
+                        'укажите --table'
+                    )
+                if file_format not in FORMATS:
+                    raise CommandError(
+                        f'{file}: неизвестный формат, укажите --format'
+                    )
+                found.append((TABLES_BY_NAME[name], file, file_format))
+        if not found:
+            raise CommandError('Нет файлов для загрузки')
+        order = {table.name: index for index, table in enumerate(TABLES)}
+        return sorted(found, key=lambda item: order[item[0].name])
+
+    def handle(self, *args, **options):
+        files = self.find_files(options)
+        verbosity = options['verbosity']
+        models = set()
+        user_ids = set()
+        started = monotonic()
+        with transaction.atomic():
+            for table, path, file_format in files:
+                loader = Loader(table, use_copy=not options['no_copy'])
+                table_started = monotonic()
+
+                def report(total):
+                    if verbosity > 1:
+                        self.stdout.write(f'{table.name}: {total}')
+
+                with open_text(path) as file:
+                    total = loader.load(
+                        read_rows(file, file_format),
+                        options['chunk_size'],
+                        report,
+                    )
+                seconds = monotonic() - table_started
+                if verbosity:
+                    self.stdout.write(
+                        f'{table.name}: {total} строк из {path.name} '
+                        f'за {seconds:.2f} с '
+                        f'({total / max(seconds, 1e-6):.0f} строк/с)'
+                    )
+                models.add(table.model)
+                user_ids |= loader.user_ids
+            if options['dry_run']:
+                transaction.set_rollback(True)
+                self.stdout.write(self.style.WARNING(
+                    'Пробный запуск: изменения отменены'
+                ))
+                return
+            self.reset_sequences(models)
+            names = {table.name for table, _, _ in files}
+            if names & {'amounts', 'carts'}:
+                rebuild_cart_totals()
+            if names & {'recipes', 'amounts', 'ingredients'}:
+                rebuild_search_ingredients()
+            if names & {'recipes', 'favorites', 'carts', 'subscriptions'}:
+                recount_counters()
+            transaction.on_commit(lambda: data_imported.send(
+                sender=self.__class__, models=models, user_ids=user_ids
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные успешно загружены за {monotonic() - started:.2f} с'
+        ))
+
+    def reset_sequences(self, models):
+        """Сдвигает счётчики id после вставки строк с явными id."""
+        connection = connections['default']
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
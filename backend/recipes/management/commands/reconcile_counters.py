@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import COUNTERS, counter_drift, recount
+
+
+class Command(BaseCommand):
+    help = 'Сверка счётчиков избранного, покупок, рецептов и подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Пересчитать счётчики, в которых найдены расхождения',
+        )
+
+    def handle(self, *args, **options):
+        differences = list(counter_drift())
+        for model, field, object_id, actual, correct in differences:
+            self.stdout.write(
+                f'{model._meta.verbose_name} {object_id}, {field}: '
+                f'{actual} вместо {correct}'
+            )
+        if not differences:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        if not options['fix']:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {len(differences)}'
+            ))
+            return
+        drifted = {}
+        for model, field, object_id, _, _ in differences:
+            drifted.setdefault((model, field), []).append(object_id)
+        with transaction.atomic():
+            for model, field, related, column in COUNTERS:
+                ids = drifted.get((model, field))
+                if ids:
+                    recount(model, field, related, column, ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики пересчитаны, исправлено: {len(differences)}'
+        ))
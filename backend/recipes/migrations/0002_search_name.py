@@ -0,0 +1,76 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+SEARCH_INDEXES = (
+    ('recipes_ingredient', 'recipes_ingredient_search_name'),
+    ('recipes_recipe', 'recipes_recipe_search_name'),
+)
+
+
+def normalize_name(value):
+    # Копия recipes.utils.normalize_name на момент миграции.
+    return ' '.join(str(value).lower().replace('ё', 'е').split())
+
+
+def fill_search_name(apps, schema_editor):
+    for model_name in ('Ingredient', 'Recipe'):
+        model = apps.get_model('recipes', model_name)
+        objects = list(model.objects.only('id', 'name'))
+        for obj in objects:
+            obj.search_name = normalize_name(obj.name)
+        model.objects.bulk_update(objects, ('search_name',), batch_size=1000)
+
+
+def create_search_indexes(apps, schema_editor):
+    """Индексы для поиска по началу строки и по вхождению.
+
+    Создаются только в PostgreSQL, в SQLite поиск работает без них.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, index in SEARCH_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index}_prefix '
+            f'ON {table} (search_name text_pattern_ops)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index}_trgm '
+            f'ON {table} USING gin (search_name gin_trgm_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, index in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index}_prefix')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='favorite',
+            new_name='favorites',
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=200, verbose_name='Название для поиска'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=200, verbose_name='Название для поиска'),
+        ),
+        migrations.RunPython(fill_search_name, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+# Поиск в том виде, в каком он был на момент миграции.
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_TEXT = "replace(replace({}.text, 'ё', 'е'), 'Ё', 'Е')"
+FTS_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert '
+    'AFTER INSERT ON recipes_recipe BEGIN '
+    f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+    'VALUES (new.id, new.search_name, new.search_ingredients, '
+    f'{FTS_TEXT.format("new")}); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update '
+    'AFTER UPDATE OF search_name, search_ingredients, text '
+    'ON recipes_recipe BEGIN '
+    f'UPDATE {FTS_TABLE} SET name = new.search_name, '
+    'ingredients = new.search_ingredients, '
+    f'text = {FTS_TEXT.format("new")} WHERE rowid = old.id; END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete '
+    'AFTER DELETE ON recipes_recipe BEGIN '
+    f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END',
+)
+SEARCH_CONFIGS = ('russian', 'english')
+SEARCH_COLUMNS = (
+    ('search_name', 'A'),
+    ('search_ingredients', 'B'),
+    ("translate(lower(text), 'ё', 'е')", 'C'),
+)
+
+
+def fill_search_ingredients(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    AmountIngredient = apps.get_model('recipes', 'AmountIngredient')
+    names = {}
+    rows = AmountIngredient.objects.order_by('id').values_list(
+        'recipe_id', 'ingredients__search_name'
+    )
+    for recipe_id, name in rows:
+        names.setdefault(recipe_id, []).append(name)
+    Recipe.objects.bulk_update(
+        [Recipe(id=recipe_id, search_ingredients=' '.join(recipe_names))
+         for recipe_id, recipe_names in names.items()],
+        ('search_ingredients',),
+        batch_size=1000,
+    )
+
+
+def create_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        vectors = ' || '.join(
+            f"setweight(to_tsvector('{config}', {column}), '{weight}')"
+            for column, weight in SEARCH_COLUMNS
+            for config in SEARCH_CONFIGS
+        )
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe ADD COLUMN IF NOT EXISTS '
+            f'search_vector tsvector GENERATED ALWAYS AS ({vectors}) STORED'
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+            'ON recipes_recipe USING gin (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING '
+            "fts5(name, ingredients, text, tokenize='unicode61')"
+        )
+        schema_editor.execute(f'DELETE FROM {FTS_TABLE}')
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+            'SELECT id, search_name, search_ingredients, '
+            f'{FTS_TEXT.format("recipes_recipe")} FROM recipes_recipe'
+        )
+        for sql in FTS_TRIGGERS:
+            schema_editor.execute(sql)
+
+
+def drop_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector'
+        )
+    elif vendor == 'sqlite':
+        for trigger in ('insert', 'update', 'delete'):
+            schema_editor.execute(
+                f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}'
+            )
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_ingredients',
+            field=models.TextField(default='', editable=False, verbose_name='Ингредиенты для поиска'),
+        ),
+        migrations.RunPython(fill_search_ingredients, migrations.RunPython.noop),
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Триггеры поиска SQLite в том виде, в каком их создала миграция 0007.
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_TEXT = "replace(replace({}.text, 'ё', 'е'), 'Ё', 'Е')"
+FTS_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert '
+    'AFTER INSERT ON recipes_recipe BEGIN '
+    f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+    'VALUES (new.id, new.search_name, new.search_ingredients, '
+    f'{FTS_TEXT.format("new")}); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update '
+    'AFTER UPDATE OF search_name, search_ingredients, text '
+    'ON recipes_recipe BEGIN '
+    f'UPDATE {FTS_TABLE} SET name = new.search_name, '
+    'ingredients = new.search_ingredients, '
+    f'text = {FTS_TEXT.format("new")} WHERE rowid = old.id; END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete '
+    'AFTER DELETE ON recipes_recipe BEGIN '
+    f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END',
+)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'MyUser')
+    counters = (
+        (Recipe, 'favorites_count', Recipe.favorites.through, 'recipe'),
+        (Recipe, 'in_carts_count', Recipe.cart.through, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'subscribers_count', User.subscribe.through, 'to_myuser'),
+    )
+    for model, field, related, column in counters:
+        rows = related.objects.filter(
+            **{column: OuterRef('pk')}
+        ).order_by().values(column).annotate(
+            total=Count('pk')
+        ).values('total')
+        model.objects.update(**{field: Coalesce(Subquery(rows), 0)})
+
+
+def restore_search(apps, schema_editor):
+    # SQLite пересоздаёт таблицу рецептов без триггеров поиска
+    # и при добавлении столбцов, и при их удалении.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_TRIGGERS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_timelineentry'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.RunPython(restore_search, migrations.RunPython.noop),
+    ]
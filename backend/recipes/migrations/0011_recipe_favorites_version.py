@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+# Триггеры поиска SQLite в том виде, в каком их создала миграция 0007.
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_TEXT = "replace(replace({}.text, 'ё', 'е'), 'Ё', 'Е')"
+FTS_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert '
+    'AFTER INSERT ON recipes_recipe BEGIN '
+    f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+    'VALUES (new.id, new.search_name, new.search_ingredients, '
+    f'{FTS_TEXT.format("new")}); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update '
+    'AFTER UPDATE OF search_name, search_ingredients, text '
+    'ON recipes_recipe BEGIN '
+    f'UPDATE {FTS_TABLE} SET name = new.search_name, '
+    'ingredients = new.search_ingredients, '
+    f'text = {FTS_TEXT.format("new")} WHERE rowid = old.id; END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete '
+    'AFTER DELETE ON recipes_recipe BEGIN '
+    f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END',
+)
+
+
+def restore_search(apps, schema_editor):
+    # SQLite пересоздаёт таблицу рецептов без триггеров поиска
+    # и при добавлении столбцов, и при их удалении.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_TRIGGERS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_version',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Версия счётчика избранного'),
+        ),
+        migrations.RunPython(restore_search, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:52
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+# Триггеры поиска SQLite в том виде, в каком их создала миграция 0007.
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_TEXT = "replace(replace({}.text, 'ё', 'е'), 'Ё', 'Е')"
+FTS_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert '
+    'AFTER INSERT ON recipes_recipe BEGIN '
+    f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+    'VALUES (new.id, new.search_name, new.search_ingredients, '
+    f'{FTS_TEXT.format("new")}); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update '
+    'AFTER UPDATE OF search_name, search_ingredients, text '
+    'ON recipes_recipe BEGIN '
+    f'UPDATE {FTS_TABLE} SET name = new.search_name, '
+    'ingredients = new.search_ingredients, '
+    f'text = {FTS_TEXT.format("new")} WHERE rowid = old.id; END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete '
+    'AFTER DELETE ON recipes_recipe BEGIN '
+    f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END',
+)
+
+
+def restore_search(apps, schema_editor):
+    # SQLite пересоздаёт таблицу рецептов без триггеров поиска
+    # и при добавлении столбцов, и при их удалении.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_TRIGGERS:
+        schema_editor.execute(sql)
+
+
+def fill_similar_computed_at(apps, schema_editor):
+    # Дата расчёта - последняя дата расчёта соседей рецепта.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    SimilarRecipe = apps.get_model('recipes', 'SimilarRecipe')
+    computed = SimilarRecipe.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        last=Max('computed_at')
+    ).values('last')
+    Recipe.objects.update(similar_computed_at=Subquery(computed))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_pulledauthor'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search),
+        migrations.AddField(
+            model_name='recipe',
+            name='similar_computed_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата расчёта похожих рецептов'),
+        ),
+        migrations.RunPython(
+            fill_similar_computed_at, migrations.RunPython.noop
+        ),
+        migrations.RunPython(restore_search, migrations.RunPython.noop),
+    ]
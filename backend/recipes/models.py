@@ -1,12 +1,15 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db.models import (CASCADE, CharField, CheckConstraint,
-                              DateTimeField, ForeignKey, ImageField,
-                              ManyToManyField, Model,
+                              DateTimeField, FloatField, ForeignKey,
+                              ImageField, Index, IntegerField, JSONField,
+                              ManyToManyField, Model, OneToOneField,
                               PositiveSmallIntegerField, Q, TextField,
                               UniqueConstraint)
 from django.db.models.functions import Length
 
+from .utils import normalize_name
+
 CharField.register_lookup(Length)
 
 User = get_user_model()
@@ -65,6 +68,12 @@ class Ingredient(Model):
         verbose_name='Единицы измерения',
         max_length=200,
     )
+    search_name = CharField(
+        verbose_name='Название для поиска',
+        max_length=200,
+        editable=False,
+        default='',
+    )
 
     class Meta:
         verbose_name = 'Ингредиент'
@@ -88,6 +97,10 @@ class Ingredient(Model):
     def __str__(self) -> str:
         return f'{self.name} {self.measurement_unit}'
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
 
 class Recipe(Model):
     """Модель рецептов."""
@@ -95,6 +108,12 @@ class Recipe(Model):
         verbose_name='Название блюда',
         max_length=200,
     )
+    search_name = CharField(
+        verbose_name='Название для поиска',
+        max_length=200,
+        editable=False,
+        default='',
+    )
     author = ForeignKey(
         verbose_name='Автор рецепта',
         related_name='recipes',
@@ -126,14 +145,49 @@ class Recipe(Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    updated_at = DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    similar_computed_at = DateTimeField(
+        verbose_name='Дата расчёта похожих рецептов',
+        null=True,
+        editable=False,
+    )
     image = ImageField(
         verbose_name='Изображение блюда',
         upload_to='recipe_images/',
     )
+    image_variants = JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = TextField(
         verbose_name='Описание блюда',
         max_length=200,
     )
+    search_ingredients = TextField(
+        verbose_name='Ингредиенты для поиска',
+        default='',
+        editable=False,
+    )
+    favorites_count = IntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = IntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    favorites_version = IntegerField(
+        verbose_name='Версия счётчика избранного',
+        default=0,
+        editable=False,
+    )
     cooking_time = PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         default=0,
@@ -149,10 +203,26 @@ class Recipe(Model):
         ),
     )
 
+    # Счётчики меняются только через `F()`, обычное сохранение
+    # их не перезаписывает.
+    counter_fields = (
+        'favorites_count', 'in_carts_count', 'favorites_version'
+    )
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', )
+        indexes = (
+            Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            Index(
+                fields=('-favorites_count', '-pub_date', '-id'),
+                name='recipe_popular_idx',
+            ),
+        )
         constraints = (
             UniqueConstraint(
                 fields=('name', 'author'),
@@ -167,6 +237,16 @@ class Recipe(Model):
     def __str__(self) -> str:
         return f'{self.name}. Автор: {self.author.username}'
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_name(self.name)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
 
 class AmountIngredient(Model):
     """Количество ингредиентов в рецепте."""
@@ -208,3 +288,166 @@ class AmountIngredient(Model):
 
     def __str__(self) -> str:
         return f'{self.amount} {self.ingredients}'
+
+
+class CartIngredient(Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Обновляется при добавлении и удалении рецептов из списка покупок
+    и при изменении рецептов, которые в нём лежат.
+    """
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='cart_ingredients',
+        to=User,
+        on_delete=CASCADE,
+    )
+    ingredient = ForeignKey(
+        verbose_name='Ингредиент',
+        related_name='cart_totals',
+        to=Ingredient,
+        on_delete=CASCADE,
+    )
+    total_amount = IntegerField(
+        verbose_name='Общее количество',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        ordering = ('user', )
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'ingredient', ),
+                name='unique_cart_ingredient',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.total_amount} {self.ingredient}'
+
+
+class SimilarRecipe(Model):
+    """Похожий рецепт: близость по составу ингредиентов.
+
+    Заполняется командой `build_similar_recipes`, `score` - косинусная
+    близость векторов ингредиентов рецептов с весами TF-IDF.
+    """
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='similar_recipes',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    similar = ForeignKey(
+        verbose_name='Похожий рецепт',
+        related_name='similar_to',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    score = FloatField(
+        verbose_name='Близость',
+    )
+    computed_at = DateTimeField(
+        verbose_name='Дата расчёта',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        ordering = ('-score',)
+        indexes = (
+            Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx',
+            ),
+        )
+        constraints = (
+            UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} ~ {self.similar_id}: {self.score:.3f}'
+
+
+class TimelineEntry(Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Новые рецепты авторов с небольшим числом подписчиков сразу
+    записываются в ленты подписчиков, рецепты популярных авторов
+    добавляются при чтении ленты. Лента каждого пользователя
+    ограничена `FEED_TIMELINE_SIZE` последними рецептами.
+    """
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='timeline',
+        to=User,
+        on_delete=CASCADE,
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='timeline_entries',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    author = ForeignKey(
+        verbose_name='Автор рецепта',
+        related_name='+',
+        to=User,
+        on_delete=CASCADE,
+    )
+    pub_date = DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        ordering = ('-pub_date',)
+        indexes = (
+            Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='timeline_user_pub_date_idx',
+            ),
+            Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx',
+            ),
+        )
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_recipe',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.recipe_id}'
+
+
+class PulledAuthor(Model):
+    """Автор, чьи рецепты добавляются в ленты при чтении.
+
+    Хранит последний рассчитанный список популярных авторов, чтобы
+    заметить автора, который перестал быть популярным, и вернуть
+    его рецепты в записанные ленты подписчиков.
+    """
+    author = OneToOneField(
+        verbose_name='Автор',
+        related_name='+',
+        to=User,
+        on_delete=CASCADE,
+        primary_key=True,
+    )
+
+    class Meta:
+        verbose_name = 'Популярный автор'
+        verbose_name_plural = 'Популярные авторы'
+
+    def __str__(self) -> str:
+        return str(self.author_id)
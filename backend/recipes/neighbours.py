@@ -0,0 +1,48 @@
+"""Ближайшие соседи по матрице близостей.
+
+Модуль выполняется в процессах пула и не импортирует Django.
+"""
+import numpy as np
+
+_matrix = None
+
+
+def top_neighbours(scores, rows, k):
+    """`k` лучших соседей для каждой строки блока близостей.
+
+    `rows` - номера строк блока в общей матрице, сам рецепт в соседи
+    не попадает. Возвращает массивы строк, столбцов и оценок.
+    """
+    result_rows, result_columns, result_scores = [], [], []
+    for position, row in enumerate(rows):
+        start, stop = scores.indptr[position], scores.indptr[position + 1]
+        columns = scores.indices[start:stop]
+        values = scores.data[start:stop]
+        keep = (columns != row) & (values > 0)
+        columns, values = columns[keep], values[keep]
+        if len(values) > k:
+            best = np.argpartition(-values, k)[:k]
+            columns, values = columns[best], values[best]
+        result_rows.append(np.full(len(values), row))
+        result_columns.append(columns)
+        result_scores.append(values)
+    if not result_rows:
+        empty = np.empty(0)
+        return empty, empty, empty
+    return (
+        np.concatenate(result_rows),
+        np.concatenate(result_columns),
+        np.concatenate(result_scores),
+    )
+
+
+def init_worker(matrix):
+    global _matrix
+    _matrix = matrix
+
+
+def block_neighbours(start, stop, k):
+    """Соседи строк `start:stop`, считается в процессе пула."""
+    stop = min(stop, _matrix.shape[0])
+    scores = (_matrix[start:stop] @ _matrix.T).tocsr()
+    return top_neighbours(scores, range(start, stop), k)
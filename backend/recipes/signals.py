@@ -0,0 +1,252 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import local
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .cart import change_recipe_in_carts, remove_recipe_from_carts
+from .counters import change_counter, forget_user, relation_changed
+from .feed import Subscription, fan_out, rebuild_timelines
+from .fulltext import search_ingredients
+from .images import image_pipeline, needs_variants
+from .models import AmountIngredient, Ingredient, Recipe, Tag
+from .similarity import mark_neighbours_stale
+
+User = get_user_model()
+
+# Отправляется после загрузки данных командой `import_data`:
+# `models` - изменённые модели, `user_ids` - пользователи,
+# у которых изменились избранное, список покупок или подписки.
+data_imported = Signal()
+
+
+_batch = local()
+
+
+def touch_recipes(recipe_ids, ingredients=False):
+    """Обновляет дату изменения рецептов.
+
+    С `ingredients=True` заодно пересобирает ингредиенты для поиска.
+    Внутри `batch_touches()` рецепты только запоминаются.
+    """
+    pending = getattr(_batch, 'recipe_ids', None)
+    if pending is not None:
+        pending.update(recipe_ids)
+        if ingredients:
+            _batch.ingredient_ids.update(recipe_ids)
+        return
+    if not ingredients:
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            updated_at=timezone.now()
+        )
+        return
+    now = timezone.now()
+    Recipe.objects.bulk_update(
+        [Recipe(id=recipe_id, updated_at=now, search_ingredients=text)
+         for recipe_id, text in search_ingredients(recipe_ids).items()],
+        ('updated_at', 'search_ingredients'),
+        batch_size=500,
+    )
+
+
+def change_carts(recipe_id, amounts):
+    """Переносит изменение ингредиентов рецепта в списки покупок.
+
+    `amounts` - словарь {id ингредиента: изменение количества}.
+    Внутри `batch_touches()` изменения копятся до конца блока.
+    """
+    pending = getattr(_batch, 'cart_amounts', None)
+    if pending is None:
+        change_recipe_in_carts(recipe_id, amounts)
+        return
+    for ingredient_id, amount in amounts.items():
+        pending[recipe_id][ingredient_id] += amount
+
+
+@contextmanager
+def batch_touches():
+    """Обновляет даты изменения рецептов и списки покупок одним разом
+    в конце блока.
+
+    Удаление строк вызывает сигналы для каждой строки, без этого
+    дата рецепта обновлялась бы по запросу на строку.
+    """
+    if getattr(_batch, 'recipe_ids', None) is not None:
+        yield
+        return
+    _batch.recipe_ids = set()
+    _batch.ingredient_ids = set()
+    _batch.cart_amounts = defaultdict(lambda: defaultdict(int))
+    try:
+        yield
+        recipe_ids = _batch.recipe_ids - _batch.ingredient_ids
+        ingredient_ids = _batch.ingredient_ids
+        cart_amounts = _batch.cart_amounts
+    finally:
+        _batch.recipe_ids = None
+        _batch.ingredient_ids = None
+        _batch.cart_amounts = None
+    if recipe_ids:
+        touch_recipes(recipe_ids)
+    if ingredient_ids:
+        touch_recipes(ingredient_ids, ingredients=True)
+    for recipe_id, amounts in cart_amounts.items():
+        change_recipe_in_carts(recipe_id, amounts)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_deleted_recipe_from_carts(sender, instance, **kwargs):
+    """Пересчитывает списки покупок перед удалением рецепта.
+
+    Связи со списками покупок удаляются раньше ингредиентов рецепта,
+    поэтому `change_cart_amount` их второй раз уже не вычитает.
+    """
+    remove_recipe_from_carts(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def outdate_similar_on_delete(sender, instance, **kwargs):
+    """Рецепты, похожие на удалённый, досчитает `--incremental`."""
+    mark_neighbours_stale(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, **kwargs):
+    """Новый рецепт увеличивает счётчик рецептов автора."""
+    if created:
+        change_counter(User, 'recipes_count', (instance.author_id,), 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    """Удалённый рецепт уменьшает счётчик рецептов автора."""
+    change_counter(User, 'recipes_count', (instance.author_id,), -1)
+
+
+@receiver(m2m_changed, sender=Recipe.favorites.through)
+@receiver(m2m_changed, sender=Recipe.cart.through)
+@receiver(m2m_changed, sender=Subscription)
+def count_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменения избранного, списков покупок и подписок через ORM
+    и админку попадают в счётчики."""
+    relation_changed(sender, instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=User)
+def count_deleted_user(sender, instance, **kwargs):
+    """Удалённый пользователь пропадает из счётчиков избранного,
+    списков покупок и подписчиков."""
+    forget_user(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def push_to_timelines(sender, instance, created, **kwargs):
+    """Новый рецепт попадает в ленты подписчиков после фиксации."""
+    if created:
+        transaction.on_commit(lambda: fan_out(instance))
+
+
+@receiver(data_imported)
+def rebuild_imported_timelines(sender, models, user_ids, **kwargs):
+    """Загрузка идёт без сигналов моделей, ленты пересобираются."""
+    if Recipe in models:
+        rebuild_timelines()
+    elif Subscription in models:
+        rebuild_timelines(user_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def render_image_variants(sender, instance, **kwargs):
+    """Новая картинка рецепта уходит на подготовку копий."""
+    if needs_variants(instance):
+        image_pipeline.schedule(instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_on_tags_change(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """Смена тегов меняет дату изменения рецепта."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_recipes((instance.id,))
+    elif pk_set:
+        touch_recipes(pk_set)
+
+
+@receiver(post_save, sender=AmountIngredient)
+@receiver(post_delete, sender=AmountIngredient)
+def touch_recipe_on_amount_change(sender, instance, **kwargs):
+    """Смена ингредиентов меняет дату изменения рецепта."""
+    touch_recipes((instance.recipe_id,), ingredients=True)
+
+
+@receiver(pre_save, sender=AmountIngredient)
+def remember_old_amount(sender, instance, **kwargs):
+    """Запоминает прежнюю строку для пересчёта списков покупок."""
+    instance._old_amount = AmountIngredient.objects.filter(
+        pk=instance.pk
+    ).values_list('ingredients', 'amount').first() if instance.pk else None
+
+
+@receiver(post_save, sender=AmountIngredient)
+@receiver(post_delete, sender=AmountIngredient)
+def change_cart_amount(sender, instance, created=None, **kwargs):
+    """Изменения ингредиентов рецепта через ORM и админку попадают
+    в списки покупок.
+
+    Массовые `bulk_create` и `bulk_update` сигналов не вызывают,
+    их изменения переносятся в списки покупок явно.
+    """
+    amounts = defaultdict(int)
+    if created is None:
+        amounts[instance.ingredients_id] -= instance.amount
+    else:
+        amounts[instance.ingredients_id] += instance.amount
+        old = getattr(instance, '_old_amount', None)
+        if old is not None:
+            ingredient_id, amount = old
+            amounts[ingredient_id] -= amount
+    change_carts(instance.recipe_id, amounts)
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_recipes_on_ingredient_change(sender, instance, created, **kwargs):
+    """Новое название ингредиента попадает в поиск рецептов."""
+    if created:
+        return
+    recipe_ids = set(AmountIngredient.objects.filter(
+        ingredients=instance
+    ).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        touch_recipes(recipe_ids, ingredients=True)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_recipes_on_tag_change(sender, instance, created=False, **kwargs):
+    """Изменение или удаление тега меняет дату изменения его рецептов."""
+    if created:
+        return
+    recipe_ids = set(Recipe.tags.through.objects.filter(
+        tag=instance
+    ).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        touch_recipes(recipe_ids)
+
+
+@receiver(post_save, sender=User)
+def touch_recipes_on_author_change(sender, instance, created, update_fields,
+                                   **kwargs):
+    """Смена данных автора меняет дату изменения его рецептов.
+
+    Вход пользователя обновляет только `last_login` и не учитывается.
+    """
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
@@ -0,0 +1,214 @@
+"""Похожие рецепты по составу ингредиентов.
+
+Рецепт - строка разреженной матрицы рецепт × ингредиент. Вес
+ингредиента - IDF: чем реже ингредиент, тем больше общий ингредиент
+сближает рецепты. Строки нормированы, поэтому произведение строк -
+косинусная близость. Для каждого рецепта хранятся `k` ближайших
+в `SimilarRecipe`, эндпоинт только читает их по индексу.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from scipy import sparse
+
+from .models import AmountIngredient, Recipe, SimilarRecipe
+from .neighbours import block_neighbours, init_worker, top_neighbours
+
+BLOCK_SIZE = 256
+WRITE_BATCH = 5000
+IN_BATCH = 500
+# Если устарела такая доля рецептов, досчёт заменяется полным расчётом.
+FULL_BUILD_SHARE = 0.5
+
+
+def build_matrix():
+    """Id рецептов по строкам и нормированная матрица TF-IDF."""
+    recipe_ids = np.fromiter(
+        Recipe.objects.order_by('id').values_list('id', flat=True).iterator(),
+        dtype=np.int64,
+    )
+    pairs = np.fromiter(
+        chain.from_iterable(AmountIngredient.objects.values_list(
+            'recipe_id', 'ingredients_id'
+        ).iterator()),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    rows = np.searchsorted(recipe_ids, pairs[:, 0])
+    ingredients, columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs)), (rows, columns)),
+        shape=(len(recipe_ids), len(ingredients)),
+    )
+    frequency = np.bincount(columns, minlength=len(ingredients))
+    idf = np.log((1 + len(recipe_ids)) / (1 + frequency)) + 1
+    matrix = matrix @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return recipe_ids, sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+def similar_objects(recipe_ids, rows, columns, scores):
+    """Строки `SimilarRecipe` по номерам строк и столбцов матрицы."""
+    rows = np.asarray(rows, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.int64)
+    return [
+        SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id, score=score)
+        for recipe_id, similar_id, score in zip(
+            recipe_ids[rows].tolist(),
+            recipe_ids[columns].tolist(),
+            np.asarray(scores, dtype=float).tolist(),
+        )
+    ]
+
+
+def build_similar(k, workers, block_size=BLOCK_SIZE):
+    """Пересчитывает соседей всех рецептов, возвращает число строк.
+
+    Блоки строк считаются параллельно в пуле процессов, результаты
+    записываются по мере готовности в одной транзакции.
+    """
+    started = timezone.now()
+    recipe_ids, matrix = build_matrix()
+    starts = range(0, len(recipe_ids), block_size)
+    total = 0
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=init_worker,
+            initargs=(matrix,),
+        ) as executor:
+            blocks = executor.map(
+                block_neighbours,
+                starts,
+                (start + block_size for start in starts),
+                (k for _ in starts),
+            )
+            for rows, columns, scores in blocks:
+                objects = similar_objects(recipe_ids, rows, columns, scores)
+                SimilarRecipe.objects.bulk_create(
+                    objects, batch_size=WRITE_BATCH
+                )
+                total += len(objects)
+        Recipe.objects.update(similar_computed_at=started)
+    return total
+
+
+def stale_recipes():
+    """Рецепты без рассчитанных соседей или изменённые после расчёта."""
+    return Recipe.objects.filter(
+        Q(similar_computed_at__isnull=True)
+        | Q(updated_at__gt=F('similar_computed_at'))
+    ).values_list('id', flat=True)
+
+
+def mark_neighbours_stale(recipe):
+    """Помечает к пересчёту рецепты, у которых `recipe` среди соседей.
+
+    После удаления рецепта их списки станут короче, пустая дата
+    расчёта делает их устаревшими для `update_similar()`.
+    """
+    Recipe.objects.filter(
+        similar_recipes__similar=recipe
+    ).update(similar_computed_at=None)
+
+
+def chunks(values, size=IN_BATCH):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+@transaction.atomic
+def update_similar(k, stale=None, workers=1, block_size=BLOCK_SIZE):
+    """Досчитывает соседей новых и изменённых рецептов.
+
+    Списки соседей пересобираются у изменённых рецептов и у рецептов,
+    в чьих списках они были: оттуда изменённый рецепт удаляется.
+    Близости считаются блоками по `block_size` строк со всеми
+    рецептами, по ним изменённый рецепт добавляется в списки
+    остальных рецептов, где теперь входит в `k` лучших. Если устарела
+    большая часть рецептов, например после загрузки данных, всё
+    считается заново через `build_similar`. Возвращает число
+    пересчитанных рецептов.
+    """
+    started = timezone.now()
+    stale = set(stale_recipes() if stale is None else stale)
+    if not stale:
+        return 0
+    recipe_ids, matrix = build_matrix()
+    if len(stale) > len(recipe_ids) * FULL_BUILD_SHARE:
+        build_similar(k, workers, block_size)
+        return len(recipe_ids)
+    recomputed = set(stale)
+    for batch in chunks(stale):
+        recomputed.update(SimilarRecipe.objects.filter(
+            similar__in=batch
+        ).values_list('recipe', flat=True))
+        SimilarRecipe.objects.filter(
+            Q(recipe__in=batch) | Q(similar__in=batch)
+        ).delete()
+    for batch in chunks(recomputed - stale):
+        SimilarRecipe.objects.filter(recipe__in=batch).delete()
+
+    lowest = np.full(len(recipe_ids), -np.inf)
+    for recipe_id, count, score in SimilarRecipe.objects.order_by().values(
+        'recipe'
+    ).annotate(
+        count=Count('id'), lowest=Min('score')
+    ).values_list('recipe', 'count', 'lowest').iterator():
+        if count >= k:
+            lowest[np.searchsorted(recipe_ids, recipe_id)] = score
+    is_stale = np.isin(recipe_ids, list(stale))
+    is_recomputed = np.isin(recipe_ids, list(recomputed))
+    rows = np.flatnonzero(is_recomputed)
+    extended = set()
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = (matrix[block] @ matrix.T).tocsr()
+        SimilarRecipe.objects.bulk_create(
+            similar_objects(recipe_ids, *top_neighbours(scores, block, k)),
+            batch_size=WRITE_BATCH,
+        )
+        pairs = scores.tocoo()
+        others = block[pairs.row]
+        keep = (
+            is_stale[others]
+            & ~is_recomputed[pairs.col]
+            & (pairs.data > 0)
+            & (pairs.data > lowest[pairs.col])
+        )
+        SimilarRecipe.objects.bulk_create(
+            similar_objects(
+                recipe_ids, pairs.col[keep], others[keep], pairs.data[keep]
+            ),
+            batch_size=WRITE_BATCH,
+        )
+        extended.update(pairs.col[keep].tolist())
+    trim_similar(recipe_ids[sorted(extended)].tolist(), k)
+    for batch in chunks(recipe_ids[rows].tolist()):
+        Recipe.objects.filter(id__in=batch).update(
+            similar_computed_at=started
+        )
+    return len(rows)
+
+
+def trim_similar(recipe_ids, k):
+    """Оставляет у рецептов только `k` лучших соседей."""
+    for batch in chunks(recipe_ids):
+        extra = []
+        kept = {}
+        for row_id, recipe_id in SimilarRecipe.objects.filter(
+            recipe__in=batch
+        ).order_by('recipe', '-score').values_list('id', 'recipe'):
+            kept[recipe_id] = kept.get(recipe_id, 0) + 1
+            if kept[recipe_id] > k:
+                extra.append(row_id)
+        for extra_batch in chunks(extra):
+            SimilarRecipe.objects.filter(id__in=extra_batch).delete()
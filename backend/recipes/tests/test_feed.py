@@ -0,0 +1,68 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from api.tests.utils import IMAGE, client_for, create_user
+from recipes.feed import feed_page, pulled_authors
+from recipes.models import Recipe
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class PulledAuthorTransitionTest(TestCase):
+    """Автор перестаёт быть популярным: его рецепты остаются в лентах."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = create_user('author')
+        self.followers = [
+            create_user(f'follower{number}') for number in range(3)
+        ]
+        self.url = f'/api/users/{self.author.id}/subscribe/'
+
+    def publish(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                name=name,
+                author=self.author,
+                text='Описание',
+                cooking_time=5,
+                image=IMAGE,
+                image_variants={'source': IMAGE},
+            ).id
+
+    def subscribe(self, user, method='post'):
+        response = getattr(client_for(user), method)(self.url)
+        self.assertIn(response.status_code, (201, 204))
+
+    def expire(self):
+        """Список популярных авторов пересчитывается заново."""
+        cache.clear()
+
+    def test_author_drops_to_limit(self):
+        first, second = self.followers[:2]
+        self.subscribe(first)
+        old = self.publish('Старый рецепт')
+        self.subscribe(second)
+        self.expire()
+        new = self.publish('Новый рецепт')
+        self.assertIn(self.author.id, pulled_authors())
+        self.assertEqual(feed_page(first, None, 10), [new, old])
+
+        self.subscribe(second, 'delete')
+        self.expire()
+        self.assertNotIn(self.author.id, pulled_authors())
+        self.assertEqual(feed_page(first, None, 10), [new, old])
+
+    def test_followed_while_pulled(self):
+        """Подписка на популярного автора не дополняет ленту, это
+        делается, когда автор перестаёт быть популярным."""
+        first, second, late = self.followers
+        self.subscribe(first)
+        self.subscribe(second)
+        old = self.publish('Старый рецепт')
+        self.expire()
+        new = self.publish('Новый рецепт')
+        self.subscribe(late)
+        for user in (first, second):
+            self.subscribe(user, 'delete')
+        self.expire()
+        self.assertEqual(feed_page(late, None, 10), [new, old])
@@ -0,0 +1,214 @@
+import math
+from random import Random
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import AmountIngredient, Ingredient, Recipe, SimilarRecipe
+from recipes.similarity import build_similar, stale_recipes, update_similar
+
+User = get_user_model()
+
+K = 3
+
+
+def expected_similar(compositions, k=K):
+    """Лучшие соседи по косинусной близости векторов TF-IDF.
+
+    `compositions` - {id рецепта: множество id ингредиентов}.
+    Возвращает {id рецепта: {id соседа: близость}}.
+    """
+    total = len(compositions)
+    frequency = {}
+    for ingredients in compositions.values():
+        for ingredient in ingredients:
+            frequency[ingredient] = frequency.get(ingredient, 0) + 1
+    idf = {
+        ingredient: math.log((1 + total) / (1 + count)) + 1
+        for ingredient, count in frequency.items()
+    }
+    norms = {
+        recipe: math.sqrt(sum(idf[item] ** 2 for item in ingredients))
+        for recipe, ingredients in compositions.items()
+    }
+    result = {}
+    for recipe, ingredients in compositions.items():
+        scores = {
+            other: sum(idf[item] ** 2 for item in ingredients & others)
+            / (norms[recipe] * norms[other])
+            for other, others in compositions.items()
+            if other != recipe and ingredients & others
+        }
+        best = sorted(scores.values(), reverse=True)[:k]
+        result[recipe] = {
+            other: score for other, score in scores.items()
+            if best and score >= best[-1]
+        }
+    return result
+
+
+class SimilarRecipesTest(TestCase):
+    """Похожие рецепты совпадают с прямым расчётом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(10)
+        ]
+        cls.random = Random(7)
+        for number in range(14):
+            cls.create_recipe(f'Рецепт {number}')
+
+    @classmethod
+    def create_recipe(cls, name):
+        recipe = Recipe.objects.create(
+            name=name,
+            author=cls.author,
+            text='Описание',
+            cooking_time=5,
+            image='recipe_images/test.png',
+            image_variants={'source': 'recipe_images/test.png'},
+        )
+        AmountIngredient.objects.bulk_create(
+            AmountIngredient(recipe=recipe, ingredients=ingredient, amount=1)
+            for ingredient in cls.random.sample(
+                cls.ingredients, cls.random.randint(1, 4)
+            )
+        )
+        return recipe
+
+    def compositions(self):
+        compositions = {
+            recipe_id: set()
+            for recipe_id in Recipe.objects.values_list('id', flat=True)
+        }
+        for recipe_id, ingredient_id in AmountIngredient.objects.values_list(
+            'recipe_id', 'ingredients_id'
+        ):
+            compositions[recipe_id].add(ingredient_id)
+        return compositions
+
+    def stored(self, recipe_id):
+        return dict(SimilarRecipe.objects.filter(
+            recipe=recipe_id
+        ).values_list('similar', 'score'))
+
+    def assert_neighbours(self, recipe_id, expected):
+        """Соседи - `K` лучших, при равных оценках любой из них."""
+        stored = self.stored(recipe_id)
+        self.assertEqual(len(stored), min(K, len(expected)))
+        for similar_id, score in stored.items():
+            self.assertIn(similar_id, expected)
+            self.assertAlmostEqual(score, expected[similar_id])
+
+    def test_build(self):
+        total = build_similar(K, workers=2, block_size=4)
+        expected = expected_similar(self.compositions())
+        self.assertEqual(total, SimilarRecipe.objects.count())
+        for recipe_id, neighbours in expected.items():
+            with self.subTest(recipe=recipe_id):
+                self.assert_neighbours(recipe_id, neighbours)
+
+    def test_incremental(self):
+        build_similar(K, workers=1)
+        new = [
+            self.create_recipe(f'Новый рецепт {number}')
+            for number in range(2)
+        ]
+        self.assertEqual(update_similar(K), 2)
+        expected = expected_similar(self.compositions())
+        for recipe in new:
+            with self.subTest(recipe=recipe.id):
+                self.assert_neighbours(recipe.id, expected[recipe.id])
+        self.assertEqual(update_similar(K), 0)
+
+    def test_deleted_neighbour(self):
+        """Рецепты, похожие на удалённый, досчитываются полностью."""
+        build_similar(K, workers=1)
+        deleted = SimilarRecipe.objects.values_list(
+            'similar', flat=True
+        ).first()
+        affected = set(SimilarRecipe.objects.filter(
+            similar=deleted
+        ).values_list('recipe', flat=True))
+        Recipe.objects.filter(id=deleted).delete()
+        self.assertEqual(set(stale_recipes()), affected)
+        self.assertGreaterEqual(update_similar(K), len(affected))
+        expected = expected_similar(self.compositions())
+        for recipe_id in affected:
+            with self.subTest(recipe=recipe_id):
+                self.assert_neighbours(recipe_id, expected[recipe_id])
+        self.assertEqual(update_similar(K), 0)
+
+    def test_edited_recipe(self):
+        """Рецепты, из чьих списков выпал изменённый рецепт, и рецепт
+        без общих ингредиентов больше не считаются устаревшими."""
+        build_similar(K, workers=1)
+        edited = SimilarRecipe.objects.values_list(
+            'similar', flat=True
+        ).first()
+        rare = Ingredient.objects.create(name='Редкий', measurement_unit='г')
+        AmountIngredient.objects.filter(recipe=edited).delete()
+        AmountIngredient.objects.create(
+            recipe_id=edited, ingredients=rare, amount=1
+        )
+        self.assertIn(edited, set(stale_recipes()))
+        update_similar(K)
+        self.assertEqual(list(stale_recipes()), [])
+        self.assertEqual(self.stored(edited), {})
+        expected = expected_similar(self.compositions())
+        for recipe_id, neighbours in expected.items():
+            with self.subTest(recipe=recipe_id):
+                self.assertEqual(
+                    len(self.stored(recipe_id)), min(K, len(neighbours))
+                )
+        self.assertEqual(update_similar(K), 0)
+
+    def test_blocks(self):
+        """Досчёт блоками даёт те же списки, что и одним блоком."""
+        build_similar(K, workers=1)
+        stale = list(Recipe.objects.values_list('id', flat=True)[:5])
+        update_similar(K, stale, block_size=1)
+        by_block = {
+            recipe_id: self.stored(recipe_id)
+            for recipe_id in Recipe.objects.values_list('id', flat=True)
+        }
+        update_similar(K, stale, block_size=100)
+        for recipe_id, stored in by_block.items():
+            with self.subTest(recipe=recipe_id):
+                self.assertEqual(self.stored(recipe_id).keys(), stored.keys())
+
+    def test_mostly_stale(self):
+        """Если устарело большинство рецептов, считается всё заново."""
+        Recipe.objects.update(similar_computed_at=None)
+        total = Recipe.objects.count()
+        self.assertEqual(update_similar(K), total)
+        expected = expected_similar(self.compositions())
+        for recipe_id, neighbours in expected.items():
+            with self.subTest(recipe=recipe_id):
+                self.assert_neighbours(recipe_id, neighbours)
+        self.assertEqual(update_similar(K), 0)
+
+    def test_endpoint(self):
+        build_similar(K, workers=1)
+        recipe_id = SimilarRecipe.objects.values_list(
+            'recipe', flat=True
+        ).first()
+        response = APIClient().get(f'/api/recipes/{recipe_id}/similar/')
+        self.assertEqual(response.status_code, 200)
+        stored = self.stored(recipe_id)
+        ids = [recipe['id'] for recipe in response.data]
+        self.assertEqual(set(ids), set(stored))
+        scores = [stored[similar_id] for similar_id in ids]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        response = APIClient().get(
+            f'/api/recipes/{recipe_id}/similar/', {'limit': 1}
+        )
+        self.assertEqual(len(response.data), 1)
@@ -0,0 +1,48 @@
+"""Уменьшенные копии картинок рецептов.
+
+Модуль не зависит от Django: функции выполняются в отдельных процессах.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Наибольшие ширина и высота копий.
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+# Расширение файла: формат Pillow и параметры сохранения.
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def flatten(image):
+    """Переводит картинку в RGB, прозрачные места заливает белым."""
+    if image.mode == 'RGB':
+        return image
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render_variants(data):
+    """Готовит копии картинки всех размеров во всех форматах.
+
+    Возвращает `{размер: {расширение: байты}}`.
+    """
+    rendered = {}
+    with Image.open(BytesIO(data)) as source:
+        image = flatten(ImageOps.exif_transpose(source))
+    for variant, size in VARIANTS.items():
+        copy = image.copy()
+        copy.thumbnail(size, Image.LANCZOS)
+        rendered[variant] = {}
+        for extension, (fmt, options) in FORMATS.items():
+            buffer = BytesIO()
+            copy.save(buffer, fmt, **options)
+            rendered[variant][extension] = buffer.getvalue()
+    return rendered
@@ -0,0 +1,7 @@
+def normalize_name(value):
+    """Приводит название к виду для поиска.
+
+    Строка переводится в нижний регистр, `ё` заменяется на `е`,
+    пробелы схлопываются.
+    """
+    return ' '.join(str(value).lower().replace('ё', 'е').split())
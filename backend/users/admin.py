@@ -7,7 +7,8 @@ from .models import MyUser
 @register(MyUser)
 class MyUserAdmin(UserAdmin):
     list_display = (
-        'username', 'first_name', 'last_name', 'email',
+        'username', 'first_name', 'last_name', 'email', 'recipes_count',
+        'subscribers_count',
     )
     fields = (
         ('username', 'email', ),
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db.models import (CharField, CheckConstraint, EmailField,
-                              ManyToManyField, Q)
+                              IntegerField, ManyToManyField, Q)
 from django.db.models.functions import Length
 from django.utils.translation import gettext_lazy as _
 
@@ -49,6 +49,20 @@ class MyUser(AbstractUser):
         to='self',
         symmetrical=False,
     )
+    recipes_count = IntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = IntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    # Счётчики меняются только через `F()`, обычное сохранение
+    # их не перезаписывает.
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -63,3 +77,12 @@ class MyUser(AbstractUser):
 
     def __str__(self):
         return f'{self.username}: {self.email}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)